@@ -0,0 +1,144 @@
+import math
+from functools import partial
+
+from qgis.PyQt.QtCore import QObject
+from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsCsException, QgsFeatureRequest, \
+    QgsVectorLayer
+
+DIRTY_EXTENT_CRS_EPSG = 3857
+MERCATOR_HALF_WORLD = 20037508.342789244
+
+
+def dirty_tiles(dirty_extents, z, render_margin, tile_size, tile_range):
+    min_x, max_x, min_y, max_y = tile_range
+    tile_span = 2 * MERCATOR_HALF_WORLD / (1 << z)
+    margin = tile_span / tile_size * render_margin / 2.0
+    tiles = set()
+    for extent in dirty_extents:
+        x0 = max(min_x, int(math.floor((extent.xMinimum() - margin + MERCATOR_HALF_WORLD) / tile_span)))
+        x1 = min(max_x, int(math.floor((extent.xMaximum() + margin + MERCATOR_HALF_WORLD) / tile_span)))
+        y0 = max(min_y, int(math.floor((MERCATOR_HALF_WORLD - extent.yMaximum() - margin) / tile_span)))
+        y1 = min(max_y, int(math.floor((MERCATOR_HALF_WORLD - extent.yMinimum() + margin) / tile_span)))
+        tiles.update((x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    return tiles
+
+
+class DirtyRegionTracker(QObject):
+    def __init__(self, project):
+        super(DirtyRegionTracker, self).__init__()
+        self.project = project
+        self.sequence = 0
+        self.dirty_extents = []
+        self.full_refresh_sequence = 0
+        self.synced_packages = {}
+        self.committing_layers = set()
+        self.tracked_layers = {}
+        self.project.layersAdded.connect(self.layersAdded)
+        self.project.layersRemoved.connect(self.layersRemoved)
+        self.project.cleared.connect(self.projectCleared)
+        self.trackLayers(self.project.mapLayers().values())
+
+    def close(self):
+        self.project.layersAdded.disconnect(self.layersAdded)
+        self.project.layersRemoved.disconnect(self.layersRemoved)
+        self.project.cleared.disconnect(self.projectCleared)
+        self.untrackLayers()
+
+    def needsFullRefresh(self, package_path):
+        synced_sequence = self.synced_packages.get(package_path)
+        return synced_sequence is None or self.full_refresh_sequence > synced_sequence
+
+    def snapshot(self, package_path):
+        synced_sequence = self.synced_packages.get(package_path, 0)
+        return self.sequence, [extent for sequence, extent in self.dirty_extents if sequence > synced_sequence]
+
+    def markSynced(self, package_path, sequence):
+        self.synced_packages[package_path] = max(sequence, self.synced_packages.get(package_path, 0))
+        oldest_synced = min(self.synced_packages.values())
+        self.dirty_extents = [(extent_sequence, extent) for extent_sequence, extent in self.dirty_extents if extent_sequence > oldest_synced]
+
+    def requireFullRefresh(self, *args):
+        self.sequence += 1
+        self.full_refresh_sequence = self.sequence
+
+    def addDirtyExtent(self, extent):
+        self.sequence += 1
+        self.dirty_extents.append((self.sequence, extent))
+
+    def projectCleared(self):
+        self.untrackLayers()
+        self.committing_layers = set()
+        self.dirty_extents = []
+        self.synced_packages = {}
+        self.requireFullRefresh()
+
+    def layersAdded(self, layers):
+        self.trackLayers(layers)
+        self.requireFullRefresh()
+
+    def layersRemoved(self, layer_ids):
+        for layer_id in layer_ids:
+            self.tracked_layers.pop(layer_id, None)
+            self.committing_layers.discard(layer_id)
+        self.requireFullRefresh()
+
+    def trackLayers(self, layers):
+        for layer in layers:
+            if layer.id() in self.tracked_layers:
+                continue
+            connections = [(layer.styleChanged, self.requireFullRefresh)]
+            if isinstance(layer, QgsVectorLayer):
+                connections += [
+                    (layer.beforeCommitChanges, partial(self.collectPendingChanges, layer)),
+                    (layer.afterCommitChanges, partial(self.commitFinished, layer)),
+                    (layer.afterRollBack, partial(self.commitFinished, layer)),
+                    (layer.editingStopped, partial(self.commitFinished, layer)),
+                    (layer.dataChanged, partial(self.vectorDataChanged, layer))
+                ]
+            else:
+                connections.append((layer.dataChanged, self.requireFullRefresh))
+            for signal, slot in connections:
+                signal.connect(slot)
+            self.tracked_layers[layer.id()] = connections
+
+    def untrackLayers(self):
+        for connections in self.tracked_layers.values():
+            for signal, slot in connections:
+                try:
+                    signal.disconnect(slot)
+                except (RuntimeError, TypeError):
+                    pass
+        self.tracked_layers = {}
+
+    def vectorDataChanged(self, layer, *args):
+        if layer.id() in self.committing_layers or layer.isModified():
+            return
+        self.requireFullRefresh()
+
+    def commitFinished(self, layer, *args):
+        self.committing_layers.discard(layer.id())
+
+    def collectPendingChanges(self, layer, *args):
+        self.committing_layers.add(layer.id())
+        edit_buffer = layer.editBuffer()
+        if edit_buffer is None:
+            return
+        if edit_buffer.addedAttributes() or edit_buffer.deletedAttributeIds():
+            self.requireFullRefresh()
+        changed_geometries = edit_buffer.changedGeometries()
+        geometries = list(changed_geometries.values())
+        geometries += [feature.geometry() for feature in edit_buffer.addedFeatures().values()]
+        changed_ids = set(changed_geometries.keys()) | set(edit_buffer.deletedFeatureIds()) | \
+            set(edit_buffer.changedAttributeValues().keys())
+        committed_ids = [fid for fid in changed_ids if fid >= 0]
+        if committed_ids:
+            request = QgsFeatureRequest().setFilterFids(committed_ids).setNoAttributes()
+            geometries += [feature.geometry() for feature in layer.dataProvider().getFeatures(request)]
+        transform = QgsCoordinateTransform(layer.crs(), QgsCoordinateReferenceSystem(f"EPSG:{DIRTY_EXTENT_CRS_EPSG}"), self.project)
+        for geometry in geometries:
+            if geometry is None or geometry.isNull():
+                continue
+            try:
+                self.addDirtyExtent(transform.transformBoundingBox(geometry.boundingBox()))
+            except QgsCsException:
+                self.requireFullRefresh()
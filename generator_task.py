@@ -1,28 +1,357 @@
-import gc
 import os
 import json
 import base64
+import hashlib
 import io
 import math
 import time
 import mercantile
+import queue
+import sys
+import threading
 import traceback
 import zipfile
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-from qgis.PyQt.QtCore import QThread, QSize, QBuffer, QIODevice, pyqtSignal
-from qgis.PyQt.QtGui import QImage, QColor
-from qgis.core import QgsMapSettings, QgsRectangle, QgsCoordinateReferenceSystem, QgsMapRendererSequentialJob
+from .dirty_regions import dirty_tiles
+from .mbtiles_writer import MBTilesWriter, mbtiles_tiles
+from .pmtiles_writer import PMTilesWriter, pmtiles_tiles, PMTILES_SPOOL_SUFFIX
+from .qgisweb_format import IMAGE_FORMAT, IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, IMAGE_FORMAT_JPEG, QGISWEB_INDEX_SUFFIX, \
+	UNIFORM_PAYLOAD_CACHE_SIZE, QgisWebWriter, QgisWebBinaryWriter, QgisWebIndexWriter, QgisWebReader, QgisWebBinaryReader, \
+	format_coord_for_json, is_qgisweb_binary
+from .tile_cache import TileCache, render_fingerprint, has_tracked_data_state, layer_style_fingerprint
 
-IMAGE_FORMAT = "PNG"
+from qgis.PyQt import sip
+from qgis.PyQt.QtCore import Qt, QThread, QSize, QBuffer, QByteArray, QIODevice, pyqtSignal
+from qgis.PyQt.QtGui import QImage, QImageWriter, QColor, QPainter
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+from qgis.core import QgsMapSettings, QgsRectangle, QgsCoordinateReferenceSystem, QgsMapRendererCustomPainterJob, \
+	QgsRenderContext, QgsSymbolLayerUtils, QgsVectorLayer, QgsRasterLayer, QgsRasterPipe, QgsRasterBlockFeedback, QgsSpatialIndex, QgsFeatureRequest, \
+	QgsCoordinateTransform, QgsProject, QgsExpression, QgsExpressionContext, QgsExpressionContextUtils, QgsTextRenderer, QgsFeedback, NULL
+
+DEFAULT_IMAGE_QUALITY = 80
+DEFAULT_PNG_COMPRESSION_LEVEL = 6
 TILE_CRS_EPSG = 3857
 PARAMS_EXTENT_CRS_EPSG = 4326
+DEFAULT_METATILE_SIZE = 8
+MIN_RENDER_MARGIN = 64
+MAX_RENDER_MARGIN = 1000
+ESTIMATED_BLEED_RENDERERS = ('singleSymbol', 'categorizedSymbol', 'graduatedSymbol', 'RuleRenderer', 'nullSymbol')
+UNESTIMATED_BLEED_SYMBOL_LAYERS = ('GeometryGenerator',)
+DEFAULT_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_ENCODE_WORKERS = 2
+RENDER_POOL_MEMORY_LIMIT = 512 * 1024 * 1024
+MIN_RENDER_POOL_IMAGES = 2
+BLOCKS_IN_FLIGHT_PER_WORKER = 2
+LL_EPSILON = 1e-11
+ENCODE_BUFFER_RESERVE = 512 * 1024
+PALETTE_MAX_COLORS = 256
+PYRAMID_RESAMPLING_BOX = 'box'
+PYRAMID_RESAMPLING_LANCZOS = 'lanczos'
+LANCZOS_LOBES = 3
+ALPHA_CHANNEL = 3 if sys.byteorder == 'little' else 0
+SPOOL_SUFFIX = '.spool'
+SPOOL_VERSION = 1
+CHECKPOINT_SYNC_INTERVAL = 30.0
+UPDATE_BACKUP_SUFFIX = '.bak'
+PACKAGE_FINGERPRINT_SUFFIX = '.fingerprint'
+OUTPUT_FORMAT_QGISWEB = 'qgisweb'
+OUTPUT_FORMAT_MBTILES = 'mbtiles'
+OUTPUT_FORMAT_PMTILES = 'pmtiles'
+OUTPUT_FORMAT_QGISWEB_BINARY = 'qgisweb2'
+
+MetatileJob = namedtuple('MetatileJob', ['z', 'x0', 'y0', 'cols', 'rows', 'tiles', 'tiles_in_block', 'cached_tiles'], defaults=[()])
+PyramidReduceJob = namedtuple('PyramidReduceJob', ['z', 'x', 'y'])
+
+
+def tile_range(west, south, east, north, z):
+	upper_left = mercantile.tile(west, north, z)
+	lower_right = mercantile.tile(east - LL_EPSILON, south + LL_EPSILON, z)
+	if lower_right.x < upper_left.x or lower_right.y < upper_left.y:
+		return None
+	return upper_left.x, lower_right.x, upper_left.y, lower_right.y
+
+
+def tiles_extent_mercator(z, x0, y0, cols=1, rows=1, buffer=0.0):
+	top_left_bounds = mercantile.xy_bounds(x0, y0, z)
+	bottom_right_bounds = mercantile.xy_bounds(x0 + cols - 1, y0 + rows - 1, z)
+	return QgsRectangle(
+		top_left_bounds.left - buffer, bottom_right_bounds.bottom - buffer,
+		bottom_right_bounds.right + buffer, top_left_bounds.top + buffer
+	)
+
+
+def png_quality(compression_level):
+	compression_level = min(9, max(0, int(compression_level)))
+	return 100 - (compression_level * 91 + 8) // 9
+
+
+def image_region_view(image, x, y, width, height):
+	bytes_per_pixel = image.depth() // 8
+	address = int(image.constBits()) + y * image.bytesPerLine() + x * bytes_per_pixel
+	return QImage(sip.voidptr(address), width, height, image.bytesPerLine(), image.format())
+
+
+def image_rows(image):
+	row_length = image.width() * image.depth() // 8
+	bytes_per_line = image.bytesPerLine()
+	pixels = image.constBits()
+	pixels.setsize((image.height() - 1) * bytes_per_line + row_length)
+	pixels_view = memoryview(pixels)
+	for offset in range(0, len(pixels_view), bytes_per_line):
+		yield pixels_view[offset:offset + row_length]
+
+
+def uniform_pixel(image):
+	bytes_per_pixel = image.depth() // 8
+	rows = image_rows(image)
+	first_row = next(rows)
+	fill_pixel = first_row[:bytes_per_pixel].tobytes()
+	fill_row = fill_pixel * image.width()
+	if first_row != fill_row or any(row != fill_row for row in rows):
+		return None
+	return fill_pixel
+
+
+def is_opaque_image(image):
+	if not image.hasAlphaChannel():
+		return True
+	if image.depth() != 32:
+		return False
+	opaque_alpha = b'\xff' * image.width()
+	return all(row[ALPHA_CHANNEL::4] == opaque_alpha for row in image_rows(image))
+
+
+def image_pixels(image):
+	return b''.join(image_rows(image))
+
+
+def lanczos_halve(pixels, axis):
+	taps = np.arange(-2 * LANCZOS_LOBES + 0.5, 2 * LANCZOS_LOBES, 1.0)
+	weights = np.sinc(taps / 2.0) * np.sinc(taps / (2.0 * LANCZOS_LOBES))
+	weights /= weights.sum()
+	pad_width = [(0, 0)] * pixels.ndim
+	pad_width[axis] = (2 * LANCZOS_LOBES - 1, 2 * LANCZOS_LOBES)
+	padded = np.pad(pixels, pad_width, mode='edge')
+	output_length = pixels.shape[axis] // 2
+	reduced = np.zeros_like(np.take(pixels, range(output_length), axis=axis))
+	for tap, weight in enumerate(weights):
+		reduced += weight * np.take(padded, range(tap, tap + 2 * output_length, 2), axis=axis)
+	return reduced
+
+
+def downsample_tiles(children, width, height, resampling=PYRAMID_RESAMPLING_BOX):
+	if np is None:
+		canvas = QImage(2 * width, 2 * height, QImage.Format_ARGB32_Premultiplied)
+		canvas.fill(Qt.transparent)
+		painter = QPainter(canvas)
+		for (dx, dy), pixels in children.items():
+			painter.drawImage(dx * width, dy * height, QImage(pixels, width, height, width * 4, QImage.Format_ARGB32_Premultiplied))
+		painter.end()
+		reduced = canvas.scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+		return image_pixels(reduced.convertToFormat(QImage.Format_ARGB32_Premultiplied))
+
+	canvas = np.zeros((2 * height, 2 * width, 4), dtype=np.uint8)
+	for (dx, dy), pixels in children.items():
+		canvas[dy * height:(dy + 1) * height, dx * width:(dx + 1) * width] = \
+			np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 4)
+	if resampling == PYRAMID_RESAMPLING_LANCZOS:
+		reduced = lanczos_halve(lanczos_halve(canvas.astype(np.float32), 0), 1)
+		reduced = np.clip(np.rint(reduced), 0, 255).astype(np.uint8)
+		alpha = reduced[..., ALPHA_CHANNEL:ALPHA_CHANNEL + 1]
+		np.minimum(reduced, alpha, out=reduced)
+	else:
+		reduced = canvas.reshape(height, 2, width, 2, 4).sum(axis=(1, 3), dtype=np.uint16)
+		reduced = ((reduced + 2) // 4).astype(np.uint8)
+	return reduced.tobytes()
+
+
+def palette_color_table(image, max_colors=PALETTE_MAX_COLORS):
+	image = image.convertToFormat(QImage.Format_ARGB32)
+	if np is None:
+		return image.convertToFormat(QImage.Format_Indexed8, Qt.ThresholdDither | Qt.AvoidDither).colorTable()
+	pixels = np.frombuffer(image_pixels(image), dtype=np.uint32)
+	colors, counts = np.unique(pixels, return_counts=True)
+	if len(colors) > max_colors:
+		alpha = pixels >> 24
+		partial_alpha = (alpha > 0) & (alpha < 255)
+		alpha = np.where(partial_alpha, (alpha & 0xF0) | 0x08, alpha)
+		reduced = np.where(alpha > 0, (pixels & 0x00F8F8F8) | 0x00040404 | (alpha << 24), 0).astype(np.uint32)
+		colors, counts = np.unique(reduced, return_counts=True)
+		colors = colors[np.argsort(counts, kind='stable')[::-1][:max_colors]]
+	return [int(color) for color in colors]
+
+
+def has_unestimated_bleed(symbol):
+	for symbol_layer in symbol.symbolLayers():
+		if symbol_layer.layerType() in UNESTIMATED_BLEED_SYMBOL_LAYERS:
+			return True
+		sub_symbol = symbol_layer.subSymbol()
+		if sub_symbol is not None and has_unestimated_bleed(sub_symbol):
+			return True
+	return False
+
+
+def metatile_blocks(min_x, max_x, min_y, max_y, size):
+	size = max(1, int(size))
+	for block_x in range(min_x - min_x % size, max_x + 1, size):
+		x0 = max(min_x, block_x)
+		x1 = min(max_x, block_x + size - 1)
+		for block_y in range(min_y - min_y % size, max_y + 1, size):
+			y0 = max(min_y, block_y)
+			y1 = min(max_y, block_y + size - 1)
+			yield x0, y0, x1 - x0 + 1, y1 - y0 + 1
+
+
+class TileEncoder:
+	def __init__(self, image_format=IMAGE_FORMAT, quality=-1, opaque_format=None, opaque_quality=-1):
+		self.image_format = image_format
+		self.quality = quality
+		self.opaque_format = opaque_format
+		self.opaque_quality = opaque_quality
+		self.encode_array = QByteArray()
+		self.encode_array.reserve(ENCODE_BUFFER_RESERVE)
+		self.encode_buffer = QBuffer(self.encode_array)
+		self.opaque_image = None
+		self.uniform_payloads = {}
+
+	def encodeUniform(self, image, fill_pixel):
+		encoded_tile = self.uniform_payloads.get(fill_pixel)
+		if encoded_tile is None:
+			opaque = len(fill_pixel) == 4 and fill_pixel[ALPHA_CHANNEL] == 255
+			encoded_tile = self.encode(image, opaque=opaque)
+			if len(self.uniform_payloads) < UNIFORM_PAYLOAD_CACHE_SIZE:
+				self.uniform_payloads[fill_pixel] = encoded_tile
+		return encoded_tile
+
+	def encode(self, image, color_table=None, opaque=False):
+		image_format, quality = self.image_format, self.quality
+		if opaque and self.opaque_format is not None:
+			image_format, quality = self.opaque_format, self.opaque_quality
+			image = image.convertToFormat(QImage.Format_RGB888)
+		elif color_table is not None:
+			image = image.convertToFormat(QImage.Format_Indexed8, color_table, Qt.ThresholdDither | Qt.AvoidDither)
+		elif opaque:
+			image = image.convertToFormat(QImage.Format_RGB888)
+		elif image_format == IMAGE_FORMAT_JPEG:
+			image = self.opaqueImage(image)
+		self.encode_buffer.open(QIODevice.WriteOnly | QIODevice.Truncate)
+		image.save(self.encode_buffer, image_format, quality)
+		self.encode_buffer.close()
+		return self.encode_array.data(), image_format
+
+	def opaqueImage(self, image):
+		if self.opaque_image is None or self.opaque_image.size() != image.size():
+			self.opaque_image = QImage(image.size(), QImage.Format_RGB32)
+		self.opaque_image.fill(Qt.white)
+		painter = QPainter(self.opaque_image)
+		painter.drawImage(0, 0, image)
+		painter.end()
+		return self.opaque_image
+
+
+class TileRenderBuffers:
+	def __init__(self, map_settings):
+		self.map_settings = QgsMapSettings(map_settings)
+		self.raster_pipes = None
+
 
+class RenderImagePool:
+	def __init__(self, map_settings, image_size, image_count):
+		self.free_images = queue.Queue()
+		dots_per_meter = int(round(map_settings.outputDpi() / 0.0254))
+		for _ in range(image_count):
+			image = QImage(image_size, map_settings.outputImageFormat())
+			image.setDotsPerMeterX(dots_per_meter)
+			image.setDotsPerMeterY(dots_per_meter)
+			self.free_images.put(image)
 
-def format_coord_for_json(coord):
-	if coord is None or math.isnan(coord) or math.isinf(coord):
-		return "0,00000000"
-	formatted = "{:.8f}".format(coord)
-	return formatted.replace('.', ',')
+	def acquire(self):
+		return self.free_images.get()
+
+	def release(self, image):
+		self.free_images.put(image)
+
+
+class TileSpool:
+	def __init__(self, path, fingerprint):
+		self.path = path
+		self.completed_tiles = set()
+		self.last_sync = time.monotonic()
+		if not self.loadCompletedTiles(fingerprint):
+			with open(path, 'wb') as spool_file:
+				spool_file.write(json.dumps({'spool': SPOOL_VERSION, 'fingerprint': fingerprint}).encode('utf-8') + b'\n')
+		self.spool_file = open(path, 'ab')
+
+	def loadCompletedTiles(self, fingerprint):
+		if not os.path.exists(self.path):
+			return False
+		with open(self.path, 'r+b') as spool_file:
+			header = spool_file.readline()
+			try:
+				header_data = json.loads(header)
+			except ValueError:
+				return False
+			if not header.endswith(b'\n') or header_data.get('fingerprint') != fingerprint:
+				return False
+			valid_length = len(header)
+			for line in spool_file:
+				if not line.endswith(b'\n'):
+					break
+				try:
+					tile_entry = json.loads(line)
+					tile_key = (int(tile_entry['z']), int(tile_entry['x']), int(tile_entry['y']))
+				except (ValueError, KeyError):
+					break
+				self.completed_tiles.add(tile_key)
+				valid_length += len(line)
+			spool_file.truncate(valid_length)
+		return True
+
+	def writeTile(self, z, x, y, image_bytes, image_format=None, uniform=False):
+		tile_entry = {
+			'z': z,
+			'x': x,
+			'y': y,
+			'f': (image_format or IMAGE_FORMAT).lower(),
+			't': base64.b64encode(image_bytes).decode('utf-8')
+		}
+		self.spool_file.write(json.dumps(tile_entry).encode('utf-8') + b'\n')
+
+	def checkpoint(self):
+		self.spool_file.flush()
+		if time.monotonic() - self.last_sync >= CHECKPOINT_SYNC_INTERVAL:
+			os.fsync(self.spool_file.fileno())
+			self.last_sync = time.monotonic()
+
+	def close(self):
+		if not self.spool_file.closed:
+			self.spool_file.flush()
+			os.fsync(self.spool_file.fileno())
+			self.spool_file.close()
+
+	def tiles(self):
+		written_tiles = set()
+		with open(self.path, 'rb') as spool_file:
+			spool_file.readline()
+			for line in spool_file:
+				tile_entry = json.loads(line)
+				tile_key = (tile_entry['z'], tile_entry['x'], tile_entry['y'])
+				if tile_key in written_tiles:
+					continue
+				written_tiles.add(tile_key)
+				yield tile_entry['z'], tile_entry['x'], tile_entry['y'], base64.b64decode(tile_entry['t']), tile_entry['f'].upper()
+
+	def remove(self):
+		self.close()
+		if os.path.exists(self.path):
+			os.remove(self.path)
 
 
 class GeneratorTask(QThread):
@@ -34,12 +363,53 @@ class GeneratorTask(QThread):
 		super(GeneratorTask, self).__init__()
 		self.tile_width = 256
 		self.tile_height = 256
-		self.render_margin = 1000
+		self.render_margin = MIN_RENDER_MARGIN
+		self.max_render_margin = MAX_RENDER_MARGIN
+		self.render_margins = {}
+		self.metatile_size = DEFAULT_METATILE_SIZE
+		self.render_workers = DEFAULT_RENDER_WORKERS
+		self.encode_workers = DEFAULT_ENCODE_WORKERS
+		self.deduplicate_tiles = False
+		self.image_format = IMAGE_FORMAT
+		self.image_quality = DEFAULT_IMAGE_QUALITY
+		self.webp_lossless = False
+		self.opaque_image_format = None
+		self.png_compression_level = DEFAULT_PNG_COMPRESSION_LEVEL
+		self.palette_png = False
+		self.pyramid_mode = False
+		self.pyramid_resampling = PYRAMID_RESAMPLING_BOX
+		self.pyramid_children = {}
+		self.resume_generation = False
+		self.output_format = OUTPUT_FORMAT_QGISWEB
+		self.write_tile_index = False
+		self.tile_ranges_per_zoom = {}
+		self.tile_cache_path = None
+		self.dirty_extents = None
+		self.dirty_tiles = None
+		self.tile_cache = None
+		self.terminated = False
+		self.cancel_lock = threading.Lock()
+		self.cancel_callbacks = set()
+		self.tile_spool = None
+		self.skip_empty_tiles = True
+		self.prune_transparent_descendants = False
+		self.feature_index = None
+		self.empty_tiles = {}
+		self.label_texts = {}
 
 	def run(self):
 		self.terminated = False
 		self.errors = []
-		tiles_processed = 0
+		self.tiles_processed = 0
+		self.skipped_tiles = 0
+		self.uniform_tiles = 0
+		self.resumed_tiles = 0
+		self.cached_tiles = 0
+		self.dirty_tiles = None
+		self.tile_cache = None
+		self.tile_spool = None
+		self.empty_tiles = {}
+		self.label_texts = {}
 		total_tiles_to_process = 0
 
 		try:
@@ -49,6 +419,13 @@ class GeneratorTask(QThread):
 				self.generation_error.emit()
 				return
 
+			supported_formats = [bytes(image_format).decode().upper() for image_format in QImageWriter.supportedImageFormats()]
+			for image_format in (self.image_format, self.opaque_image_format):
+				if image_format is not None and image_format not in supported_formats:
+					self.errors.append(f"Format kafli {image_format} nie jest obsługiwany przez tę instalację QGIS")
+					return
+			self.quantize_palette = self.palette_png and self.image_format == IMAGE_FORMAT_PNG
+
 			tile_ranges_per_zoom = {}
 			for z in self.zoom_levels:
 				try:
@@ -62,12 +439,13 @@ class GeneratorTask(QThread):
 						tile_ranges_per_zoom[z] = None
 						continue
 
-					tiles_in_extent = list(mercantile.tiles(west, south, east, north, zooms=[z]))
-					if tiles_in_extent:
-						min_x = min(t.x for t in tiles_in_extent) - 1
-						max_x = max(t.x for t in tiles_in_extent) + 1
-						min_y = min(t.y for t in tiles_in_extent) - 1
-						max_y = max(t.y for t in tiles_in_extent) + 1
+					tiles_in_extent = tile_range(west, south, east, north, z)
+					if tiles_in_extent is not None:
+						min_x, max_x, min_y, max_y = tiles_in_extent
+						min_x -= 1
+						max_x += 1
+						min_y -= 1
+						max_y += 1
 
 						max_tile_index = (1 << z) - 1
 						min_x = max(0, min_x)
@@ -88,6 +466,7 @@ class GeneratorTask(QThread):
 			if total_tiles_to_process == 0:
 				self.generation_info.emit("Brak kafli do wygenerowania")
 				return
+			self.tile_ranges_per_zoom = tile_ranges_per_zoom
 
 			self.generation_info.emit(f"Łącznie do przetworzenia: {total_tiles_to_process} kafli.")
 			self.progress_started.emit(total_tiles_to_process)
@@ -99,145 +478,860 @@ class GeneratorTask(QThread):
 			map_settings.setFlag(QgsMapSettings.Flag.UseAdvancedEffects, False)
 			map_settings.setFlag(QgsMapSettings.Flag.Antialiasing, True)
 
-			with open(self.tiles_path, 'w') as output_file:
-				output_file.write('{\n')
-				output_file.write('  "params": {\n')
-				output_file.write('    "extent": {\n')
-				output_file.write(
-					f'      "lon_min": "{format_coord_for_json(self.tiles_extent_wgs84.xMinimum())}",\n')
-				output_file.write(
-					f'      "lon_max": "{format_coord_for_json(self.tiles_extent_wgs84.xMaximum())}",\n')
-				output_file.write(
-					f'      "lat_min": "{format_coord_for_json(self.tiles_extent_wgs84.yMinimum())}",\n')
-				output_file.write(
-					f'      "lat_max": "{format_coord_for_json(self.tiles_extent_wgs84.yMaximum())}",\n')
-				output_file.write(f'      "dxy": "0",\n')
-				output_file.write(f'      "dh": "0",\n')
-				output_file.write(f'      "epsg": "0"\n')
-				output_file.write('    }\n')
-				output_file.write('  },\n')
-				output_file.write('  "tiles": [\n')
-
-				first_tile_written = False
-				self.generation_info.emit("Rozpoczynanie renderowania kafli...")
-
-				for z in self.zoom_levels:
-					if tile_ranges_per_zoom.get(z) is None:
-						continue
-					min_x, max_x, min_y, max_y = tile_ranges_per_zoom[z]
-					self.generation_info.emit(f"Przetwarzanie Zoom Level: {z} (Kafle X: {min_x}-{max_x}, Y: {min_y}-{max_y})")
-
-					for x in range(min_x, max_x + 1):
-						for y in range(min_y, max_y + 1):
-							tiles_processed += 1
-							try:
-								tile_bounds_mercator = mercantile.xy_bounds(x, y, z)
-								tile_extent_mercator_qgs = QgsRectangle(
-									tile_bounds_mercator.left, tile_bounds_mercator.bottom,
-									tile_bounds_mercator.right, tile_bounds_mercator.top
-								)
-
-								if tile_extent_mercator_qgs.width() == 0 or abs(tile_extent_mercator_qgs.height()) == 0:
-									self.generation_info.emit(f"Ostrzeżenie: Kafel {z}/{x}/{y} ma zerowy wymiar. Pomijanie.")
-									continue
-
-								final_tile_width = self.tile_width
-								final_tile_height = self.tile_height
-
-								render_width_px = final_tile_width + self.render_margin
-								render_height_px = final_tile_height + self.render_margin
-
-								pixel_res_x = tile_extent_mercator_qgs.width() / final_tile_width
-								pixel_res_y = abs(tile_extent_mercator_qgs.height()) / final_tile_height
-
-								if pixel_res_y <= 1e-9:
-									self.generation_info.emit(f"Ostrzeżenie: Bardzo mała wysokość piksela dla {z}/{x}/{y}. Pomijanie.")
-									continue
-
-								x_offset_map_units = pixel_res_x * (self.render_margin / 2.0)
-								y_offset_map_units = pixel_res_y * (self.render_margin / 2.0)
-
-								extent_for_render = QgsRectangle(
-									tile_extent_mercator_qgs.xMinimum() - x_offset_map_units,
-									tile_extent_mercator_qgs.yMinimum() - y_offset_map_units,
-									tile_extent_mercator_qgs.xMaximum() + x_offset_map_units,
-									tile_extent_mercator_qgs.yMaximum() + y_offset_map_units
-								)
-
-								map_settings.setExtent(extent_for_render)
-								map_settings.setOutputSize(QSize(render_width_px, render_height_px))
-
-								job = QgsMapRendererSequentialJob(map_settings)
-								job.start()
-								job.waitForFinished()
-
-								rendered_large_image = job.renderedImage()
-
-								if rendered_large_image.isNull():
-									image_to_save = QImage(QSize(final_tile_width, final_tile_height), QImage.Format_ARGB32_Premultiplied)
-									image_to_save.fill(QColor(0, 0, 0, 0))
-								elif rendered_large_image.size() != QSize(render_width_px, render_height_px):
-									self.errors.append(f"Renderowanie (z marginesem) {z}/{x}/{y} dało zły rozmiar.")
-									continue
-								else:
-									if self.render_margin > 0:
-										crop_offset = self.render_margin // 2
-										image_to_save = rendered_large_image.copy(crop_offset, crop_offset,
-																				  final_tile_width, final_tile_height)
-									else:
-										image_to_save = rendered_large_image
-
-								if image_to_save.isNull() or image_to_save.size() != QSize(final_tile_width,
-																						   final_tile_height):
-									self.errors.append(f"Obraz do zapisu dla {z}/{x}/{y} jest nieprawidłowy po cięciu/przypisaniu.")
-									continue
-
-								buffer = QBuffer()
-								buffer.open(QIODevice.ReadWrite)
-								image_to_save.save(buffer, IMAGE_FORMAT)
-								image_bytes = buffer.data()
-								buffer.close()
-
-								if not image_bytes:
-									self.errors.append(f"Konwersja obrazu kafla {z}/{x}/{y} do {IMAGE_FORMAT} nie dała danych.")
-									continue
-
-								base64_string = base64.b64encode(image_bytes).decode('utf-8')
-
-								tile_entry = {'x': str(x), 'y': str(y), 'z': str(z), 't': base64_string}
-
-								if first_tile_written:
-									output_file.write(',\n    ')
-								else:
-									output_file.write('    ')
-									first_tile_written = True
-
-								json.dump(tile_entry, output_file)
-
-							except mercantile.TileArgParsingError as tae:
-								self.errors.append(f"Błąd mercantile dla {z}/{x}/{y}: {tae}.")
-							except Exception as e_tile:
-								self.errors.append(f"Błąd podczas przetwarzania kafla {z}/{x}/{y}: {e_tile}")
-
-							if tiles_processed % 20 == 0 or tiles_processed == total_tiles_to_process:
-								self.progress_updated.emit(tiles_processed)
-
-				if first_tile_written:
-					output_file.write('\n  ')
-				output_file.write(']\n')
-				output_file.write('}\n')
-			with open(self.tiles_path, "r", encoding="utf-8") as f:
-				data = json.load(f)
-			with open(self.tiles_path, "w", encoding="utf-8") as file:
-				file.write(base64.b64encode(json.dumps(data).encode("utf-8")).decode("utf-8"))
-			if self.zip_pack:
-				with zipfile.ZipFile(self.tiles_path.replace('.qgisweb', '.zip'), 'w', compression=zipfile.ZIP_DEFLATED) as arch:
-					arch.write(self.tiles_path, arcname=os.path.basename(self.tiles_path))
+			self.raster_fast_path = self.canUseRasterFastPath()
+			if self.raster_fast_path:
+				self.generation_info.emit("Tylko warstwy rastrowe: odczyt bloków rastra bezpośrednio w siatce kafli, bez marginesu renderowania.")
+			self.render_margins = {}
+			for z in self.zoom_levels:
+				if self.terminated:
+					return
+				if tile_ranges_per_zoom.get(z) is None:
+					continue
+				if self.raster_fast_path:
+					self.render_margins[z] = 0
+					continue
+				try:
+					self.render_margins[z] = self.computeRenderMargin(map_settings, z)
+				except Exception as e:
+					self.generation_info.emit(f"Ostrzeżenie: Nie udało się wyznaczyć marginesu renderowania dla Z={z}: {e}")
+					self.render_margins[z] = self.max_render_margin
+				self.generation_info.emit(f"Zoom {z}: Margines renderowania {self.render_margins[z]} px")
+
+			package_fingerprint = self.generationFingerprint(map_settings, include_data_state=False)
+			update_package = self.dirty_extents is not None and os.path.exists(self.outputPath())
+			if update_package and self.readPackageFingerprint() != package_fingerprint:
+				self.generation_info.emit("Zasięg, poziomy powiększenia, styl lub ustawienia kafli różnią się od istniejącego pakietu, pakiet zostanie wygenerowany w całości.")
+				update_package = False
+			if update_package and not self.dirty_extents:
+				self.generation_info.emit("Brak zmian w danych od ostatniego generowania, pakiet jest aktualny")
+				return
+			if not update_package:
+				self.removePackageFingerprint()
+
+			self.feature_index = None
+			if self.skip_empty_tiles and not self.terminated:
 				try:
-					os.remove(self.tiles_path)
-				except:
-					pass
+					self.feature_index = self.buildFeatureIndex(tile_crs)
+				except Exception as e:
+					self.generation_info.emit(f"Ostrzeżenie: Nie udało się zbudować indeksu przestrzennego, puste kafle nie będą pomijane: {e}")
+			if self.terminated:
+				return
+
+			untracked_layers = [layer.name() for layer in self.layers_to_render if not has_tracked_data_state(layer)]
+			if self.tile_cache_path and untracked_layers:
+				self.generation_info.emit(f"Pamięć podręczna kafli pominięta, nie można wykryć zmian danych warstw: {', '.join(untracked_layers)}")
+			elif self.tile_cache_path:
+				try:
+					self.tile_cache = TileCache(self.tile_cache_path)
+					self.cache_fingerprints = self.cacheFingerprints(map_settings)
+					self.tile_cache.touch(self.cache_fingerprints.values())
+					self.tile_cache.prune(set(self.cache_fingerprints.values()))
+				except Exception as e:
+					self.tile_cache = None
+					self.generation_info.emit(f"Ostrzeżenie: Pamięć podręczna kafli niedostępna, kafle zostaną wyrenderowane: {e}")
+			if self.terminated:
+				return
+
+			if update_package:
+				self.updatePackage(tile_ranges_per_zoom, map_settings)
+				if self.terminated:
+					return
+			elif self.resume_generation:
+				self.tile_spool = TileSpool(self.tiles_path + SPOOL_SUFFIX, self.generationFingerprint(map_settings))
+				if self.tile_spool.completed_tiles:
+					self.generation_info.emit(f"Wznawianie generowania: {len(self.tile_spool.completed_tiles)} kafli zapisanych w poprzednim uruchomieniu.")
+				self.tile_writer = self.tile_spool
+				try:
+					self.renderTiles(tile_ranges_per_zoom, map_settings)
+				finally:
+					self.tile_spool.close()
+				if self.terminated:
+					self.generation_info.emit(f"Generowanie przerwane, gotowe kafle zachowane w pliku {self.tile_spool.path}")
+					return
+				self.generation_info.emit("Składanie pakietu kafli z pliku pośredniego...")
+				with self.openTileWriter() as self.tile_writer:
+					for z, x, y, image_bytes, image_format in self.tile_spool.tiles():
+						if self.terminated:
+							break
+						self.tile_writer.writeTile(z, x, y, image_bytes, image_format)
+				if self.terminated:
+					self.removeOutput()
+					self.generation_info.emit(f"Generowanie przerwane, gotowe kafle zachowane w pliku {self.tile_spool.path}")
+					return
+				if self.errors:
+					self.generation_info.emit(f"Plik pośredni {self.tile_spool.path} zachowany, ponowne uruchomienie uzupełni brakujące kafle.")
+				else:
+					self.tile_spool.remove()
+			else:
+				with self.openTileWriter() as self.tile_writer:
+					self.renderTiles(tile_ranges_per_zoom, map_settings)
+				if self.terminated:
+					self.removeOutput()
+					return
+			if self.errors:
+				self.removePackageFingerprint()
+			else:
+				self.writePackageFingerprint(package_fingerprint)
+
+			if self.tile_writer.duplicates_written > 0:
+				self.generation_info.emit(f"Zduplikowane kafle zapisane jako odwołania: {self.tile_writer.duplicates_written}")
+			if self.cached_tiles > 0:
+				self.generation_info.emit(f"Kafle pobrane z pamięci podręcznej: {self.cached_tiles}")
+			if self.resumed_tiles > 0:
+				self.generation_info.emit(f"Kafle przejęte z poprzedniego uruchomienia: {self.resumed_tiles}")
+			if self.uniform_tiles > 0:
+				self.generation_info.emit(f"Kafle jednolite zapisane bez ponownego kodowania: {self.uniform_tiles}")
+			if self.skipped_tiles > 0:
+				self.generation_info.emit(f"Pominięto {self.skipped_tiles} pustych kafli.")
 		except Exception as e_main:
 			self.errors.append(f"Krytyczny błąd w wątku generowania: {e_main}\n{traceback.format_exc()}")
 		finally:
-			gc.collect()
+			self.releaseResources()
+
+	def updatePackage(self, tile_ranges_per_zoom, map_settings):
+		self.dirty_tiles = {}
+		for z, z_tile_range in tile_ranges_per_zoom.items():
+			if z_tile_range is not None:
+				self.dirty_tiles[z] = dirty_tiles(self.dirty_extents, z, self.render_margins[z], self.tile_width, z_tile_range)
+		dirty_tiles_count = sum(len(z_dirty_tiles) for z_dirty_tiles in self.dirty_tiles.values())
+		if self.tile_cache is not None:
+			for z, z_dirty_tiles in self.dirty_tiles.items():
+				self.tile_cache.invalidate(z, z_dirty_tiles)
+		self.generation_info.emit(f"Aktualizacja pakietu: {dirty_tiles_count} kafli w zmienionych obszarach.")
+		self.progress_started.emit(dirty_tiles_count)
+		if self.pyramid_mode:
+			self.generation_info.emit("Aktualizacja pakietu renderuje zmienione kafle bez trybu piramidy.")
+			self.pyramid_mode = False
+
+		output_path = self.outputPath()
+		backup_path = output_path + UPDATE_BACKUP_SUFFIX
+		os.replace(output_path, backup_path)
+		try:
+			with self.openTileWriter() as self.tile_writer:
+				self.renderTiles(tile_ranges_per_zoom, map_settings)
+				for z, x, y, image_bytes, image_format in self.packageTiles(backup_path):
+					if self.terminated:
+						break
+					if (x, y) not in self.dirty_tiles.get(z, ()):
+						self.tile_writer.writeTile(z, x, y, image_bytes, image_format)
+		except Exception:
+			os.replace(backup_path, output_path)
+			self.removeTileIndex()
+			raise
+		if self.terminated:
+			os.replace(backup_path, output_path)
+			self.removeTileIndex()
+			self.generation_info.emit("Aktualizacja pakietu przerwana, przywrócono poprzednią wersję.")
+		else:
+			os.remove(backup_path)
+
+	def cancel(self):
+		self.terminated = True
+		with self.cancel_lock:
+			cancel_callbacks = list(self.cancel_callbacks)
+		for cancel_callback in cancel_callbacks:
+			cancel_callback()
+
+	@contextmanager
+	def cancellable(self, cancel_callback):
+		with self.cancel_lock:
+			self.cancel_callbacks.add(cancel_callback)
+		try:
+			yield
+		finally:
+			with self.cancel_lock:
+				self.cancel_callbacks.discard(cancel_callback)
+
+	def releaseResources(self):
+		if self.tile_cache is not None:
+			try:
+				self.tile_cache.close()
+			except Exception as e:
+				self.generation_info.emit(f"Ostrzeżenie: Nie udało się zapisać pamięci podręcznej kafli: {e}")
+			self.tile_cache = None
+		self.image_pool = None
+		self.worker_state = None
+		self.encoder_state = None
+		self.encode_executor = None
+		self.pyramid_encoder = None
+		self.pyramid_children = {}
+		self.base_map_settings = None
+		self.feature_index = None
+		self.empty_tiles = {}
+		self.tile_spool = None
+		self.tile_writer = None
+
+	def packageTiles(self, path):
+		if self.output_format == OUTPUT_FORMAT_MBTILES:
+			return mbtiles_tiles(path)
+		if self.output_format == OUTPUT_FORMAT_PMTILES:
+			return pmtiles_tiles(path)
+		if is_qgisweb_binary(path):
+			return QgisWebBinaryReader(path).tiles()
+		return QgisWebReader(path).tiles()
+
+	def outputPath(self):
+		if self.output_format == OUTPUT_FORMAT_MBTILES:
+			return os.path.splitext(self.tiles_path)[0] + '.mbtiles'
+		if self.output_format == OUTPUT_FORMAT_PMTILES:
+			return os.path.splitext(self.tiles_path)[0] + '.pmtiles'
+		if self.zip_pack:
+			return self.tiles_path.replace('.qgisweb', '.zip')
+		return self.tiles_path
+
+	def removeOutput(self):
+		try:
+			if os.path.exists(self.outputPath()):
+				os.remove(self.outputPath())
+		except OSError as e:
+			self.generation_info.emit(f"Ostrzeżenie: Nie udało się usunąć niekompletnego pliku {self.outputPath()}: {e}")
+		self.removeTileIndex()
+		self.removePackageFingerprint()
+
+	def packageFingerprintPath(self):
+		return self.outputPath() + PACKAGE_FINGERPRINT_SUFFIX
+
+	def readPackageFingerprint(self):
+		try:
+			with open(self.packageFingerprintPath(), 'r', encoding='utf-8') as fingerprint_file:
+				return json.load(fingerprint_file).get('fingerprint')
+		except (OSError, ValueError, AttributeError):
+			return None
+
+	def writePackageFingerprint(self, package_fingerprint):
+		try:
+			with open(self.packageFingerprintPath(), 'w', encoding='utf-8') as fingerprint_file:
+				json.dump({'fingerprint': package_fingerprint}, fingerprint_file)
+		except OSError as e:
+			self.generation_info.emit(f"Ostrzeżenie: Nie udało się zapisać pliku {self.packageFingerprintPath()}, kolejna aktualizacja wygeneruje pakiet w całości: {e}")
+
+	def removePackageFingerprint(self):
+		try:
+			if os.path.exists(self.packageFingerprintPath()):
+				os.remove(self.packageFingerprintPath())
+		except OSError as e:
+			self.generation_info.emit(f"Ostrzeżenie: Nie udało się usunąć pliku {self.packageFingerprintPath()}: {e}")
+
+	def generatedPaths(self):
+		output_path = self.outputPath()
+		paths = [self.tiles_path, self.tiles_path + SPOOL_SUFFIX, self.tileIndexPath(), output_path, self.packageFingerprintPath(),
+				 output_path + UPDATE_BACKUP_SUFFIX, output_path + PMTILES_SPOOL_SUFFIX, output_path + '-wal', output_path + '-shm',
+				 output_path + '-journal']
+		return {os.path.normcase(os.path.abspath(path)) for path in paths}
+
+	def tileIndexPath(self):
+		return self.tiles_path + QGISWEB_INDEX_SUFFIX
+
+	def removeTileIndex(self):
+		if self.output_format not in (OUTPUT_FORMAT_QGISWEB, OUTPUT_FORMAT_QGISWEB_BINARY):
+			return
+		try:
+			if os.path.exists(self.tileIndexPath()):
+				os.remove(self.tileIndexPath())
+		except OSError as e:
+			self.generation_info.emit(f"Ostrzeżenie: Nie udało się usunąć indeksu kafli {self.tileIndexPath()}: {e}")
+
+	@contextmanager
+	def openTileWriter(self):
+		if self.output_format in (OUTPUT_FORMAT_MBTILES, OUTPUT_FORMAT_PMTILES):
+			writer_class = MBTilesWriter if self.output_format == OUTPUT_FORMAT_MBTILES else PMTilesWriter
+			tile_writer = writer_class(self.outputPath(), self.tiles_extent_wgs84, self.zoom_levels, self.image_format)
+			try:
+				yield tile_writer
+			finally:
+				tile_writer.close()
+				if self.output_format == OUTPUT_FORMAT_MBTILES and len(tile_writer.tile_formats) > 1:
+					self.generation_info.emit(f"Ostrzeżenie: Pakiet MBTiles zawiera kafle w kilku formatach ({', '.join(sorted(tile_writer.tile_formats))}), "
+											  f"a MBTiles dopuszcza tylko jeden; w metadanych zapisano format {tile_writer.packageFormat()}.")
+		else:
+			tile_index = None
+			if self.write_tile_index and self.output_format == OUTPUT_FORMAT_QGISWEB:
+				tile_index = QgisWebIndexWriter(self.tileIndexPath(), self.tile_ranges_per_zoom)
+			else:
+				self.removeTileIndex()
+			try:
+				with self.openOutputStream() as output_file:
+					if self.output_format == OUTPUT_FORMAT_QGISWEB_BINARY:
+						tile_writer = QgisWebBinaryWriter(output_file, self.tiles_extent_wgs84, self.deduplicate_tiles, self.image_format)
+					else:
+						tile_writer = QgisWebWriter(output_file, self.tiles_extent_wgs84, self.deduplicate_tiles, self.image_format, tile_index)
+					yield tile_writer
+					tile_writer.close()
+			finally:
+				if tile_index is not None:
+					tile_index.close()
+
+	@contextmanager
+	def openOutputStream(self):
+		if self.zip_pack:
+			with zipfile.ZipFile(self.outputPath(), 'w', compression=zipfile.ZIP_DEFLATED) as arch:
+				with arch.open(os.path.basename(self.tiles_path), 'w', force_zip64=True) as output_stream:
+					yield output_stream
+		else:
+			with open(self.tiles_path, 'wb') as output_stream:
+				yield output_stream
+
+	def renderTiles(self, tile_ranges_per_zoom, map_settings):
+		self.generation_info.emit("Rozpoczynanie renderowania kafli...")
+
+		self.base_map_settings = map_settings
+		self.worker_state = threading.local()
+		self.raster_pipe_lock = threading.Lock()
+		self.pyramid_encoder = self.createTileEncoder()
+		render_image_side = self.metatile_size * max(self.tile_width, self.tile_height) + max(self.render_margins.values())
+		self.render_image_size = QSize(render_image_side, render_image_side)
+		render_workers = max(1, int(self.render_workers))
+		encode_workers = max(1, int(self.encode_workers))
+		max_blocks_in_flight = (render_workers + encode_workers) * BLOCKS_IN_FLIGHT_PER_WORKER
+		render_image_bytes = render_image_side * render_image_side * 4
+		pool_images = max(MIN_RENDER_POOL_IMAGES, min(render_workers + encode_workers, RENDER_POOL_MEMORY_LIMIT // render_image_bytes))
+		self.image_pool = RenderImagePool(map_settings, self.render_image_size, pool_images)
+		self.encoder_state = threading.local()
+		self.generation_info.emit(f"Liczba wątków renderowania: {render_workers}, kodowania: {encode_workers}")
+		self.generation_info.emit(f"Bufory renderowania: {pool_images} x {render_image_bytes // (1024 * 1024)} MB "
+								  f"(limit {RENDER_POOL_MEMORY_LIMIT // (1024 * 1024)} MB)")
+
+		with ThreadPoolExecutor(max_workers=encode_workers) as encode_executor, \
+				ThreadPoolExecutor(max_workers=render_workers) as render_executor:
+			self.encode_executor = encode_executor
+			pending_blocks = deque()
+			if self.pyramid_mode and self.canBuildPyramid(tile_ranges_per_zoom):
+				jobs = self.pyramidJobs(tile_ranges_per_zoom)
+			else:
+				self.pyramid_mode = False
+				jobs = self.zoomJobs(tile_ranges_per_zoom, pending_blocks)
+			for block in jobs:
+				if self.terminated:
+					break
+				rendered_future = None
+				if isinstance(block, MetatileJob) and block.tiles:
+					rendered_future = render_executor.submit(self.renderMetatileInWorker, block)
+				pending_blocks.append((block, rendered_future))
+				self.flushBlocks(pending_blocks, max_blocks_in_flight - 1)
+			self.flushBlocks(pending_blocks)
+
+	def zoomJobs(self, tile_ranges_per_zoom, pending_blocks):
+		for z in self.zoom_levels:
+			if tile_ranges_per_zoom.get(z) is None:
+				continue
+			if self.prune_transparent_descendants:
+				self.flushBlocks(pending_blocks)
+			if self.dirty_tiles is not None:
+				yield from self.dirtyMetatileJobs(z, tile_ranges_per_zoom[z])
+			else:
+				yield from self.metatileJobs(z, tile_ranges_per_zoom[z])
+
+	def dirtyMetatileJobs(self, z, tile_range):
+		min_x, max_x, min_y, max_y = tile_range
+		z_dirty_tiles = self.dirty_tiles.get(z, set())
+		self.generation_info.emit(f"Przetwarzanie Zoom Level: {z} (zmienione kafle: {len(z_dirty_tiles)})")
+		dirty_blocks = {}
+		for x, y in z_dirty_tiles:
+			block_key = (x - x % self.metatile_size, y - y % self.metatile_size)
+			dirty_blocks.setdefault(block_key, set()).add((x, y))
+		for (block_x, block_y), candidate_tiles in sorted(dirty_blocks.items()):
+			x0, y0 = max(min_x, block_x), max(min_y, block_y)
+			x1 = min(max_x, block_x + self.metatile_size - 1)
+			y1 = min(max_y, block_y + self.metatile_size - 1)
+			yield self.metatileJob(z, x0, y0, x1 - x0 + 1, y1 - y0 + 1, candidate_tiles)
+
+	def metatileJobs(self, z, tile_range):
+		min_x, max_x, min_y, max_y = tile_range
+		self.generation_info.emit(f"Przetwarzanie Zoom Level: {z} (Kafle X: {min_x}-{max_x}, Y: {min_y}-{max_y})")
+		for x0, y0, cols, rows in metatile_blocks(min_x, max_x, min_y, max_y, self.metatile_size):
+			yield self.metatileJob(z, x0, y0, cols, rows)
+
+	def metatileJob(self, z, x0, y0, cols, rows, candidate_tiles=None):
+		tiles = self.nonEmptyTiles(z, x0, y0, cols, rows)
+		tiles_in_block = cols * rows
+		if candidate_tiles is not None:
+			tiles = [tile for tile in tiles if tile in candidate_tiles]
+			tiles_in_block = len(candidate_tiles)
+		self.skipped_tiles += tiles_in_block - len(tiles)
+		if self.tile_spool is not None:
+			pending_tiles = [(x, y) for x, y in tiles if not self.isTileCompleted(z, x, y)]
+			self.resumed_tiles += len(tiles) - len(pending_tiles)
+			tiles = pending_tiles
+		cached_tiles = []
+		if self.tile_cache is not None and tiles:
+			cached_payloads = self.tile_cache.lookup(self.cache_fingerprints[z], z, x0, x0 + cols - 1, y0, y0 + rows - 1)
+			cached_tiles = [(x, y) + cached_payloads[(x, y)] for x, y in tiles if (x, y) in cached_payloads]
+			tiles = [(x, y) for x, y in tiles if (x, y) not in cached_payloads]
+			self.cached_tiles += len(cached_tiles)
+		if tiles and len(tiles) < cols * rows:
+			render_x0 = min(x for x, y in tiles)
+			render_y0 = min(y for x, y in tiles)
+			render_cols = max(x for x, y in tiles) - render_x0 + 1
+			render_rows = max(y for x, y in tiles) - render_y0 + 1
+			return MetatileJob(z, render_x0, render_y0, render_cols, render_rows, tiles, tiles_in_block, cached_tiles)
+		return MetatileJob(z, x0, y0, cols, rows, tiles, tiles_in_block, cached_tiles)
+
+	def canBuildPyramid(self, tile_ranges_per_zoom):
+		pyramid_zooms = sorted(z for z in self.zoom_levels if tile_ranges_per_zoom.get(z) is not None)
+		if len(pyramid_zooms) < 2 or pyramid_zooms != list(range(pyramid_zooms[0], pyramid_zooms[-1] + 1)):
+			self.generation_info.emit("Tryb piramidy wymaga co najmniej dwóch kolejnych poziomów powiększenia, renderowanie standardowe.")
+			return False
+		if np is None:
+			self.generation_info.emit("Brak modułu numpy, pomniejszanie kafli przez QImage.scaled.")
+		return True
+
+	def pyramidJobs(self, tile_ranges_per_zoom):
+		self.pyramid_ranges = tile_ranges_per_zoom
+		self.pyramid_children = {}
+		pyramid_zooms = sorted(z for z in self.zoom_levels if tile_ranges_per_zoom.get(z) is not None)
+		self.pyramid_top_zoom = pyramid_zooms[-1]
+		block_zoom = max(pyramid_zooms[0], self.pyramid_top_zoom - int(math.log2(max(1, self.metatile_size))))
+		self.generation_info.emit(f"Tryb piramidy: renderowanie Zoom {self.pyramid_top_zoom}, "
+								  f"poziomy {pyramid_zooms[0]}-{self.pyramid_top_zoom - 1} z pomniejszenia ({self.pyramid_resampling})")
+		min_x, max_x, min_y, max_y = tile_ranges_per_zoom[pyramid_zooms[0]]
+		for x in range(min_x, max_x + 1):
+			for y in range(min_y, max_y + 1):
+				yield from self.pyramidSubtreeJobs(pyramid_zooms[0], x, y, block_zoom)
+
+	def pyramidSubtreeJobs(self, z, x, y, block_zoom):
+		if z < block_zoom:
+			for child_x, child_y in self.pyramidChildren(z, x, y):
+				yield from self.pyramidSubtreeJobs(z + 1, child_x, child_y, block_zoom)
+			yield self.pyramidTileJob(z, x, y)
+			return
+
+		for level in range(self.pyramid_top_zoom, z - 1, -1):
+			scale = 1 << (level - z)
+			min_x, max_x, min_y, max_y = self.pyramid_ranges[level]
+			x0, x1 = max(min_x, x * scale), min(max_x, (x + 1) * scale - 1)
+			y0, y1 = max(min_y, y * scale), min(max_y, (y + 1) * scale - 1)
+			if x0 > x1 or y0 > y1:
+				continue
+			if level == self.pyramid_top_zoom:
+				yield self.metatileJob(level, x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+				continue
+			for level_x in range(x0, x1 + 1):
+				for level_y in range(y0, y1 + 1):
+					yield self.pyramidTileJob(level, level_x, level_y)
+
+	def pyramidChildren(self, z, x, y):
+		min_x, max_x, min_y, max_y = self.pyramid_ranges[z + 1]
+		return [(child_x, child_y) for child_x in (2 * x, 2 * x + 1) for child_y in (2 * y, 2 * y + 1)
+				if min_x <= child_x <= max_x and min_y <= child_y <= max_y]
+
+	def isPyramidReduced(self, z, x, y):
+		if not self.pyramid_mode or self.pyramid_ranges.get(z) is None or z >= self.pyramid_top_zoom:
+			return False
+		return len(self.pyramidChildren(z, x, y)) == 4
+
+	def pyramidTileJob(self, z, x, y):
+		if self.isTileCompleted(z, x, y):
+			self.resumed_tiles += 1
+			return MetatileJob(z, x, y, 1, 1, [], 1)
+		if self.isPyramidReduced(z, x, y):
+			return PyramidReduceJob(z, x, y)
+		return self.metatileJob(z, x, y, 1, 1)
+
+	def needsPyramidPixels(self, z, x, y):
+		return self.isPyramidReduced(z - 1, x >> 1, y >> 1) and not self.isTileCompleted(z - 1, x >> 1, y >> 1)
+
+	def isTileCompleted(self, z, x, y):
+		if self.tile_spool is None or (z, x, y) not in self.tile_spool.completed_tiles:
+			return False
+		if self.pyramid_mode and self.isPyramidReduced(z - 1, x >> 1, y >> 1):
+			return self.isTileCompleted(z - 1, x >> 1, y >> 1)
+		return True
+
+	def generationFingerprint(self, map_settings, include_data_state=True):
+		extent = self.tiles_extent_wgs84
+		generation_params = {
+			'extent': [format_coord_for_json(coord) for coord in (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())],
+			'zoom_levels': list(self.zoom_levels),
+			'render_margins': sorted(self.render_margins.items()),
+			'render_settings': self.renderSettings(map_settings),
+			'pyramid': [self.pyramid_mode, self.pyramid_resampling]
+		}
+		if include_data_state:
+			return render_fingerprint(self.layers_to_render, generation_params, self.generatedPaths())
+		generation_params['layers'] = [[layer.id(), layer.source(), layer_style_fingerprint(layer)] for layer in self.layers_to_render]
+		return hashlib.sha1(json.dumps(generation_params, sort_keys=True).encode('utf-8')).hexdigest()
+
+	def reducePyramidTile(self, job):
+		if self.terminated:
+			return 0
+		children = {}
+		for dx in (0, 1):
+			for dy in (0, 1):
+				pixels = self.pyramid_children.pop((job.z + 1, 2 * job.x + dx, 2 * job.y + dy), None)
+				if pixels is not None:
+					children[(dx, dy)] = pixels
+		if not children:
+			self.skipped_tiles += 1
+			return 1
+		try:
+			pixels = downsample_tiles(children, self.tile_width, self.tile_height, self.pyramid_resampling)
+			image = QImage(pixels, self.tile_width, self.tile_height, self.tile_width * 4, QImage.Format_ARGB32_Premultiplied)
+			color_table = palette_color_table(image) if self.quantize_palette else None
+			image_bytes, image_format = self.pyramid_encoder.encode(image, color_table, is_opaque_image(image))
+			if self.needsPyramidPixels(job.z, job.x, job.y):
+				self.pyramid_children[(job.z, job.x, job.y)] = pixels
+			self.tile_writer.writeTile(job.z, job.x, job.y, image_bytes, image_format)
+		except Exception as e_tile:
+			self.errors.append(f"Błąd podczas pomniejszania kafla {job.z}/{job.x}/{job.y}: {e_tile}")
+		return 1
+
+	def flushBlocks(self, pending_blocks, max_pending=0):
+		while len(pending_blocks) > max_pending:
+			block, rendered_future = pending_blocks.popleft()
+			if isinstance(block, PyramidReduceJob):
+				self.tiles_processed += self.reducePyramidTile(block)
+			else:
+				self.tiles_processed += self.writeMetatile(block, rendered_future)
+			if self.tile_spool is not None:
+				self.tile_spool.checkpoint()
+			self.progress_updated.emit(self.tiles_processed)
+
+	def buildFeatureIndex(self, tile_crs):
+		feature_index = QgsSpatialIndex()
+		transform_context = QgsProject.instance().transformContext()
+		index_id = 0
+		for layer in self.layers_to_render:
+			if isinstance(layer, QgsVectorLayer) and layer.renderer() is not None \
+					and layer.renderer().type() != 'invertedPolygonRenderer':
+				feedback = QgsFeedback()
+				request = QgsFeatureRequest().setNoAttributes().setDestinationCrs(tile_crs, transform_context)
+				request.setFeedback(feedback)
+				with self.cancellable(feedback.cancel):
+					for feature in layer.getFeatures(request):
+						if self.terminated:
+							return None
+						if feature.hasGeometry():
+							feature_index.addFeature(index_id, feature.geometry().boundingBox())
+							index_id += 1
+			else:
+				transform = QgsCoordinateTransform(layer.crs(), tile_crs, transform_context)
+				feature_index.addFeature(index_id, transform.transformBoundingBox(layer.extent()))
+				index_id += 1
+		self.generation_info.emit(f"Indeks przestrzenny: {index_id} obiektów")
+		return feature_index
+
+	def nonEmptyTiles(self, z, x0, y0, cols, rows):
+		block_tiles = [(x0 + i, y0 + j) for i in range(cols) for j in range(rows)
+					   if not self.hasEmptyAncestor(z, x0 + i, y0 + j)]
+		if self.feature_index is None or not block_tiles:
+			return block_tiles
+		tile_size = tiles_extent_mercator(z, x0, y0).width()
+		buffer = tile_size / self.tile_width * self.render_margins.get(z, self.max_render_margin) / 2.0
+		if not self.feature_index.intersects(tiles_extent_mercator(z, x0, y0, cols, rows, buffer)):
+			self.markEmptyTiles(z, block_tiles)
+			return []
+		tiles = []
+		for x, y in block_tiles:
+			if self.feature_index.intersects(tiles_extent_mercator(z, x, y, buffer=buffer)):
+				tiles.append((x, y))
+			else:
+				self.markEmptyTiles(z, [(x, y)])
+		return tiles
+
+	def markEmptyTiles(self, z, tiles):
+		self.empty_tiles.setdefault(z, set()).update(tiles)
+
+	def hasEmptyAncestor(self, z, x, y):
+		for parent_z, empty_tiles in self.empty_tiles.items():
+			if parent_z < z and ((x >> (z - parent_z)), (y >> (z - parent_z))) in empty_tiles:
+				return True
+		return False
+
+	def renderMetatileInWorker(self, block):
+		buffers = getattr(self.worker_state, 'buffers', None)
+		if buffers is None:
+			buffers = TileRenderBuffers(self.base_map_settings)
+			self.worker_state.buffers = buffers
+		if self.terminated:
+			return None
+		image = self.image_pool.acquire()
+		try:
+			crop_offset = self.renderMetatile(buffers, image, block)
+			if crop_offset is not None:
+				encoded_future = self.encode_executor.submit(self.encodeMetatileInWorker, block, image, crop_offset)
+				image = None
+				return encoded_future
+		except mercantile.TileArgParsingError as tae:
+			self.errors.append(f"Błąd mercantile dla metakafla {block.z}/{block.x0}/{block.y0}: {tae}.")
+		except Exception as e_block:
+			self.errors.append(f"Błąd podczas renderowania metakafla {block.z}/{block.x0}/{block.y0} ({block.cols}x{block.rows}): {e_block}")
+		finally:
+			if image is not None:
+				self.image_pool.release(image)
+		return None
+
+	def encodeMetatileInWorker(self, block, image, crop_offset):
+		encoder = getattr(self.encoder_state, 'encoder', None)
+		if encoder is None:
+			encoder = self.createTileEncoder()
+			self.encoder_state.encoder = encoder
+		try:
+			return self.encodeMetatile(encoder, block, image, crop_offset)
+		except Exception as e_block:
+			self.errors.append(f"Błąd podczas kodowania metakafla {block.z}/{block.x0}/{block.y0} ({block.cols}x{block.rows}): {e_block}")
+		finally:
+			self.image_pool.release(image)
+		return []
+
+	def writeMetatile(self, block, rendered_future):
+		for x, y, image_bytes, image_format in block.cached_tiles:
+			try:
+				if self.needsPyramidPixels(block.z, x, y):
+					self.pyramid_children[(block.z, x, y)] = self.decodeTilePixels(image_bytes)
+				self.tile_writer.writeTile(block.z, x, y, image_bytes, image_format)
+			except Exception as e_tile:
+				self.errors.append(f"Błąd podczas zapisu kafla {block.z}/{x}/{y} z pamięci podręcznej: {e_tile}")
+		if rendered_future is None:
+			return block.tiles_in_block
+		encoded_future = rendered_future.result()
+		if encoded_future is None:
+			return block.tiles_in_block
+		encoded_tiles = encoded_future.result()
+		if self.tile_cache is not None and encoded_tiles:
+			try:
+				self.tile_cache.store(self.cache_fingerprints[block.z], block.z,
+									  [(x, y, image_bytes, image_format) for x, y, image_bytes, image_format, fill_pixel, pixels in encoded_tiles])
+			except Exception as e_cache:
+				self.errors.append(f"Błąd zapisu metakafla {block.z}/{block.x0}/{block.y0} do pamięci podręcznej: {e_cache}")
+		for x, y, image_bytes, image_format, fill_pixel, pixels in encoded_tiles:
+			try:
+				if self.prune_transparent_descendants and fill_pixel is not None and not any(fill_pixel):
+					self.markEmptyTiles(block.z, [(x, y)])
+				if pixels is not None and self.needsPyramidPixels(block.z, x, y):
+					self.pyramid_children[(block.z, x, y)] = pixels
+				if fill_pixel is not None:
+					self.uniform_tiles += 1
+				self.tile_writer.writeTile(block.z, x, y, image_bytes, image_format, fill_pixel is not None)
+			except Exception as e_tile:
+				self.errors.append(f"Błąd podczas przetwarzania kafla {block.z}/{x}/{y}: {e_tile}")
+		return block.tiles_in_block
+
+	def decodeTilePixels(self, image_bytes):
+		image = QImage.fromData(image_bytes)
+		if image.width() != self.tile_width or image.height() != self.tile_height:
+			return None
+		return image_pixels(image.convertToFormat(QImage.Format_ARGB32_Premultiplied))
+
+	def renderSettings(self, map_settings):
+		return {
+			'tile_size': [self.tile_width, self.tile_height],
+			'map_flags': int(map_settings.flags()),
+			'dpi': map_settings.outputDpi(),
+			'image_format': int(map_settings.outputImageFormat()),
+			'raster_fast_path': self.raster_fast_path,
+			'encoding': [self.image_format, self.opaque_image_format, self.image_quality, self.webp_lossless,
+						 self.png_compression_level, self.palette_png]
+		}
+
+	def cacheFingerprints(self, map_settings):
+		layers_fingerprint = render_fingerprint(self.layers_to_render, self.renderSettings(map_settings), self.generatedPaths())
+		return {z: hashlib.sha1(f"{layers_fingerprint}:{render_margin}".encode('utf-8')).hexdigest()
+				for z, render_margin in self.render_margins.items()}
+
+	def renderMetatile(self, buffers, image, block):
+		z, x0, y0, cols, rows = block.z, block.x0, block.y0, block.cols, block.rows
+		block_extent_mercator_qgs = tiles_extent_mercator(z, x0, y0, cols, rows)
+
+		if block_extent_mercator_qgs.width() == 0 or abs(block_extent_mercator_qgs.height()) == 0:
+			self.generation_info.emit(f"Ostrzeżenie: Metakafel {z}/{x0}/{y0} ma zerowy wymiar. Pomijanie.")
+			return None
+
+		render_margin = self.render_margins.get(z, self.max_render_margin)
+		block_width_px = cols * self.tile_width
+		block_height_px = rows * self.tile_height
+
+		render_width_px = block_width_px + render_margin
+		render_height_px = block_height_px + render_margin
+
+		if render_width_px > image.width() or render_height_px > image.height():
+			self.errors.append(f"Metakafel {z}/{x0}/{y0} nie mieści się w buforze renderowania.")
+			return None
+
+		pixel_res_x = block_extent_mercator_qgs.width() / block_width_px
+		pixel_res_y = abs(block_extent_mercator_qgs.height()) / block_height_px
+
+		if pixel_res_y <= 1e-9:
+			self.generation_info.emit(f"Ostrzeżenie: Bardzo mała wysokość piksela dla metakafla {z}/{x0}/{y0}. Pomijanie.")
+			return None
+
+		x_offset_map_units = pixel_res_x * (render_margin / 2.0)
+		y_offset_map_units = pixel_res_y * (render_margin / 2.0)
+
+		extent_for_render = QgsRectangle(
+			block_extent_mercator_qgs.xMinimum() - x_offset_map_units,
+			block_extent_mercator_qgs.yMinimum() - y_offset_map_units,
+			block_extent_mercator_qgs.xMaximum() + x_offset_map_units,
+			block_extent_mercator_qgs.yMaximum() + y_offset_map_units
+		)
+
+		map_settings = buffers.map_settings
+		map_settings.setExtent(extent_for_render)
+		map_settings.setOutputSize(QSize(render_width_px, render_height_px))
+
+		painter = QPainter(image)
+		painter.setCompositionMode(QPainter.CompositionMode_Source)
+		painter.fillRect(0, 0, render_width_px, render_height_px, Qt.transparent)
+		painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+		if self.raster_fast_path:
+			self.renderRasterBlocks(buffers, painter)
+		else:
+			job = QgsMapRendererCustomPainterJob(map_settings, painter)
+			with self.cancellable(job.cancelWithoutBlocking):
+				if not self.terminated:
+					job.renderSynchronously()
+		painter.end()
+		if self.terminated:
+			return None
+		return render_margin // 2
+
+	def encodeMetatile(self, encoder, block, image, crop_offset):
+		z, x0, y0 = block.z, block.x0, block.y0
+		color_table = None
+		if self.quantize_palette:
+			color_table = palette_color_table(image_region_view(image, crop_offset, crop_offset,
+																block.cols * self.tile_width, block.rows * self.tile_height))
+		rendered_tiles = []
+		for x, y in block.tiles:
+			if self.terminated:
+				return []
+			tile_view = image_region_view(image, crop_offset + (x - x0) * self.tile_width,
+										  crop_offset + (y - y0) * self.tile_height,
+										  self.tile_width, self.tile_height)
+			fill_pixel = uniform_pixel(tile_view)
+			if fill_pixel is not None:
+				image_bytes, image_format = encoder.encodeUniform(tile_view, fill_pixel)
+			else:
+				image_bytes, image_format = encoder.encode(tile_view, color_table, is_opaque_image(tile_view))
+			if not image_bytes:
+				self.errors.append(f"Konwersja obrazu kafla {z}/{x}/{y} do {self.image_format} nie dała danych.")
+				continue
+			pixels = image_pixels(tile_view) if self.pyramid_mode and self.needsPyramidPixels(z, x, y) else None
+			rendered_tiles.append((x, y, image_bytes, image_format, fill_pixel, pixels))
+		return rendered_tiles
+
+	def createTileEncoder(self):
+		lossy_quality = min(99, max(0, int(self.image_quality)))
+		if self.image_format == IMAGE_FORMAT_PNG:
+			quality = png_quality(self.png_compression_level)
+		elif self.image_format == IMAGE_FORMAT_WEBP and self.webp_lossless:
+			quality = 100
+		else:
+			quality = lossy_quality
+		return TileEncoder(self.image_format, quality, self.opaque_image_format, lossy_quality)
+
+	def canUseRasterFastPath(self):
+		if not self.layers_to_render:
+			return False
+		return all(isinstance(layer, QgsRasterLayer) and layer.isValid() and layer.renderer() is not None
+				   for layer in self.layers_to_render)
+
+	def rasterPipes(self, buffers):
+		if buffers.raster_pipes is None:
+			transform_context = QgsProject.instance().transformContext()
+			destination_crs = buffers.map_settings.destinationCrs()
+			raster_pipes = []
+			with self.raster_pipe_lock:
+				for layer in reversed(self.layers_to_render):
+					pipe = QgsRasterPipe(layer.pipe())
+					if pipe.projector() is not None:
+						pipe.projector().setCrs(layer.crs(), destination_crs, transform_context)
+					raster_pipes.append((layer, pipe))
+			buffers.raster_pipes = raster_pipes
+		return buffers.raster_pipes
+
+	def renderRasterBlocks(self, buffers, painter):
+		map_settings = buffers.map_settings
+		extent = map_settings.extent()
+		output_size = map_settings.outputSize()
+		scale = map_settings.scale()
+		feedback = QgsRasterBlockFeedback()
+		for layer, pipe in self.rasterPipes(buffers):
+			if layer.hasScaleBasedVisibility() and not layer.isInScaleRange(scale):
+				continue
+			with self.cancellable(feedback.cancel):
+				if self.terminated:
+					return
+				raster_block = pipe.last().block(1, extent, output_size.width(), output_size.height(), feedback)
+			if raster_block is None or not raster_block.isValid():
+				continue
+			block_image = raster_block.image()
+			if block_image.isNull():
+				continue
+			painter.setCompositionMode(layer.blendMode())
+			painter.drawImage(0, 0, block_image)
+
+	def computeRenderMargin(self, map_settings, z):
+		margin_settings = QgsMapSettings(map_settings)
+		margin_settings.setExtent(tiles_extent_mercator(z, 0, 0))
+		margin_settings.setOutputSize(QSize(self.tile_width, self.tile_height))
+		context = QgsRenderContext.fromMapSettings(margin_settings)
+
+		bleed_px = 0.0
+		for layer in self.layers_to_render:
+			if isinstance(layer, QgsRasterLayer):
+				continue
+			if not isinstance(layer, QgsVectorLayer):
+				return self.max_render_margin
+
+			renderer = layer.renderer()
+			if layer.diagramsEnabled() or (renderer is not None and renderer.type() not in ESTIMATED_BLEED_RENDERERS):
+				return self.max_render_margin
+			if renderer is not None:
+				for symbol in renderer.symbols(context):
+					if has_unestimated_bleed(symbol):
+						return self.max_render_margin
+					bleed_px = max(bleed_px, QgsSymbolLayerUtils.estimateMaxSymbolBleed(symbol, context))
+
+			labeling = layer.labeling()
+			if layer.labelsEnabled() and labeling is not None:
+				for provider_id in labeling.subProviders():
+					bleed_px = max(bleed_px, self.labelBleed(layer, provider_id, labeling.settings(provider_id), context))
+
+		margin = 2 * int(math.ceil(bleed_px))
+		margin = max(self.render_margin, min(self.max_render_margin, margin))
+		return margin + margin % 2
+
+	def labelBleed(self, layer, provider_id, settings, context):
+		if settings is None:
+			return 0.0
+		label_key = (layer.id(), provider_id)
+		if label_key not in self.label_texts:
+			self.label_texts[label_key] = self.longestLabelText(layer, settings)
+		longest_text = self.label_texts[label_key]
+		if longest_text is None:
+			return self.max_render_margin
+		text_format = settings.format()
+		bleed_px = QgsTextRenderer.textWidth(context, text_format, longest_text.split('\n')) if longest_text else 0.0
+		text_buffer = text_format.buffer()
+		if text_buffer.enabled():
+			bleed_px += context.convertToPainterUnits(text_buffer.size(), text_buffer.sizeUnit(),
+													  text_buffer.sizeMapUnitScale())
+		bleed_px += context.convertToPainterUnits(max(abs(settings.xOffset), abs(settings.yOffset)), settings.offsetUnits,
+												  settings.labelOffsetMapUnitScale)
+		bleed_px += context.convertToPainterUnits(abs(settings.dist), settings.distUnits, settings.distMapUnitScale)
+		return bleed_px
+
+	def longestLabelText(self, layer, settings):
+		label_expression = settings.fieldName if settings.isExpression else QgsExpression.quotedColumnRef(settings.fieldName)
+		expression = QgsExpression(label_expression)
+		expression_context = QgsExpressionContext(QgsExpressionContextUtils.globalProjectLayerScopes(layer))
+		if not expression.prepare(expression_context):
+			return None
+		request = QgsFeatureRequest().setSubsetOfAttributes(expression.referencedColumns(), layer.fields())
+		if not expression.needsGeometry():
+			request.setFlags(QgsFeatureRequest.NoGeometry)
+		feedback = QgsFeedback()
+		request.setFeedback(feedback)
+		longest_text = ''
+		with self.cancellable(feedback.cancel):
+			for feature in layer.getFeatures(request):
+				if self.terminated:
+					return None
+				expression_context.setFeature(feature)
+				value = expression.evaluate(expression_context)
+				if value is None or value == NULL:
+					continue
+				label_text = str(value)
+				if len(label_text) > len(longest_text):
+					longest_text = label_text
+		return longest_text
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import sqlite3
+
+MBTILES_BATCH_SIZE = 500
+MBTILES_TRANSACTION_SIZE = 20000
+MBTILES_FORMATS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}
+
+
+def mbtiles_tiles(path):
+    connection = sqlite3.connect(path)
+    try:
+        metadata = dict(connection.execute('SELECT name, value FROM metadata').fetchall())
+        image_format = next((qt_format for qt_format, mbtiles_format in MBTILES_FORMATS.items()
+                             if mbtiles_format == metadata.get('format')), 'PNG')
+        for z, x, tms_y, tile_data in connection.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles'):
+            yield z, x, (1 << z) - 1 - tms_y, bytes(tile_data), image_format
+    finally:
+        connection.close()
+
+
+class MBTilesWriter:
+    def __init__(self, path, extent_wgs84, zoom_levels, image_format='PNG'):
+        self.path = path
+        self.extent_wgs84 = extent_wgs84
+        self.zoom_levels = list(zoom_levels)
+        self.image_format = image_format
+        self.tile_formats = set()
+        self.tiles_written = 0
+        self.duplicates_written = 0
+        self.written_images = set()
+        self.pending_images = []
+        self.pending_map = []
+        self.rows_in_transaction = 0
+        for stale_path in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT)')
+        self.connection.execute('CREATE TABLE images (tile_id TEXT PRIMARY KEY, tile_data BLOB)')
+        self.connection.execute('CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT, '
+                                'PRIMARY KEY (zoom_level, tile_column, tile_row))')
+        self.connection.execute('CREATE VIEW tiles AS SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, '
+                                'map.tile_row AS tile_row, images.tile_data AS tile_data '
+                                'FROM map JOIN images ON images.tile_id = map.tile_id')
+        self.connection.commit()
+
+    def writeTile(self, z, x, y, image_bytes, image_format=None, uniform=False):
+        self.tile_formats.add(image_format or self.image_format)
+        tile_id = hashlib.sha1(image_bytes).hexdigest()
+        if tile_id in self.written_images:
+            self.duplicates_written += 1
+        else:
+            self.written_images.add(tile_id)
+            self.pending_images.append((tile_id, image_bytes))
+        self.pending_map.append((z, x, (1 << z) - 1 - y, tile_id))
+        self.tiles_written += 1
+        if len(self.pending_map) >= MBTILES_BATCH_SIZE:
+            self.flushBatch()
+
+    def flushBatch(self):
+        self.connection.executemany('INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)', self.pending_images)
+        self.connection.executemany('INSERT OR REPLACE INTO map (zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)',
+                                    self.pending_map)
+        self.rows_in_transaction += len(self.pending_map)
+        self.pending_images = []
+        self.pending_map = []
+        if self.rows_in_transaction >= MBTILES_TRANSACTION_SIZE:
+            self.connection.commit()
+            self.rows_in_transaction = 0
+
+    def packageFormat(self):
+        return next(iter(self.tile_formats)) if len(self.tile_formats) == 1 else self.image_format
+
+    def writeMetadata(self):
+        west, south = self.extent_wgs84.xMinimum(), self.extent_wgs84.yMinimum()
+        east, north = self.extent_wgs84.xMaximum(), self.extent_wgs84.yMaximum()
+        min_zoom, max_zoom = min(self.zoom_levels), max(self.zoom_levels)
+        metadata = {
+            'name': os.path.splitext(os.path.basename(self.path))[0],
+            'type': 'baselayer',
+            'version': '1',
+            'description': 'Generator mapy C-GeoPortal',
+            'format': MBTILES_FORMATS.get(self.packageFormat(), self.packageFormat().lower()),
+            'bounds': f'{west:.8f},{south:.8f},{east:.8f},{north:.8f}',
+            'center': f'{(west + east) / 2:.8f},{(south + north) / 2:.8f},{min_zoom}',
+            'minzoom': str(min_zoom),
+            'maxzoom': str(max_zoom)
+        }
+        self.connection.executemany('INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)', metadata.items())
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.flushBatch()
+        self.writeMetadata()
+        self.connection.commit()
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.connection.execute('PRAGMA journal_mode=DELETE')
+        self.connection.close()
+        self.connection = None
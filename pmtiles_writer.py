@@ -0,0 +1,267 @@
+import gzip
+import hashlib
+import json
+import os
+import struct
+
+PMTILES_MAGIC = b'PMTiles'
+PMTILES_VERSION = 3
+PMTILES_HEADER_SIZE = 127
+PMTILES_ROOT_DIRECTORY_MAX_SIZE = 16384 - PMTILES_HEADER_SIZE
+PMTILES_LEAF_DIRECTORY_MIN_ENTRIES = 4096
+PMTILES_COMPRESSION_NONE = 1
+PMTILES_COMPRESSION_GZIP = 2
+PMTILES_TILE_TYPE_UNKNOWN = 0
+PMTILES_TILE_TYPES = {'PNG': 2, 'JPEG': 3, 'WEBP': 4}
+PMTILES_SPOOL_SUFFIX = '.data'
+PMTILES_COPY_CHUNK_SIZE = 1 << 20
+PMTILES_HEADER_STRUCT = struct.Struct('<7sBQQQQQQQQQQQBBBBBBiiiiBii')
+
+
+def hilbert_rotate(n, x, y, rx, ry):
+    if ry == 0:
+        if rx == 1:
+            x = n - 1 - x
+            y = n - 1 - y
+        x, y = y, x
+    return x, y
+
+
+def zxy_tile_id(z, x, y):
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    n = 1 << z
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        x, y = hilbert_rotate(n, x, y, rx, ry)
+        s >>= 1
+    return tile_id
+
+
+def tile_id_zxy(tile_id):
+    z = 0
+    zoom_start = 0
+    while zoom_start + (1 << (2 * z)) <= tile_id:
+        zoom_start += 1 << (2 * z)
+        z += 1
+    d = tile_id - zoom_start
+    x = y = 0
+    s = 1
+    while s < (1 << z):
+        rx = 1 & (d >> 1)
+        ry = 1 & (d ^ rx)
+        x, y = hilbert_rotate(s, x, y, rx, ry)
+        x += s * rx
+        y += s * ry
+        d >>= 2
+        s <<= 1
+    return z, x, y
+
+
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def serialize_directory(entries):
+    buffer = bytearray()
+    write_varint(buffer, len(entries))
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        write_varint(buffer, tile_id - last_id)
+        last_id = tile_id
+    for _, run_length, _, _ in entries:
+        write_varint(buffer, run_length)
+    for _, _, _, length in entries:
+        write_varint(buffer, length)
+    previous_end = None
+    for _, _, offset, length in entries:
+        write_varint(buffer, 0 if offset == previous_end else offset + 1)
+        previous_end = offset + length
+    return gzip.compress(bytes(buffer), mtime=0)
+
+
+def deserialize_directory(data):
+    data = gzip.decompress(data)
+    count, position = read_varint(data, 0)
+    tile_ids = []
+    last_id = 0
+    for _ in range(count):
+        delta, position = read_varint(data, position)
+        last_id += delta
+        tile_ids.append(last_id)
+    run_lengths = []
+    for _ in range(count):
+        run_length, position = read_varint(data, position)
+        run_lengths.append(run_length)
+    lengths = []
+    for _ in range(count):
+        length, position = read_varint(data, position)
+        lengths.append(length)
+    entries = []
+    for i in range(count):
+        value, position = read_varint(data, position)
+        offset = entries[-1][2] + entries[-1][3] if value == 0 and i > 0 else value - 1
+        entries.append((tile_ids[i], run_lengths[i], offset, lengths[i]))
+    return entries
+
+
+def build_directories(entries):
+    root = serialize_directory(entries)
+    if len(root) <= PMTILES_ROOT_DIRECTORY_MAX_SIZE:
+        return root, b''
+    leaf_size = PMTILES_LEAF_DIRECTORY_MIN_ENTRIES
+    while True:
+        leaves = bytearray()
+        root_entries = []
+        for start in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[start:start + leaf_size])
+            root_entries.append((entries[start][0], 0, len(leaves), len(leaf)))
+            leaves += leaf
+        root = serialize_directory(root_entries)
+        if len(root) <= PMTILES_ROOT_DIRECTORY_MAX_SIZE:
+            return root, bytes(leaves)
+        leaf_size *= 2
+
+
+def pmtiles_tiles(path):
+    with open(path, 'rb') as pmtiles_file:
+        header = PMTILES_HEADER_STRUCT.unpack(pmtiles_file.read(PMTILES_HEADER_SIZE))
+        if header[0] != PMTILES_MAGIC or header[1] != PMTILES_VERSION or header[14] != PMTILES_COMPRESSION_GZIP:
+            raise ValueError(f"Nieobsługiwany plik PMTiles: {path}")
+        root_offset, root_length, _, _, leaf_offset, _, data_offset = header[2:9]
+        image_format = next((qt_format for qt_format, tile_type in PMTILES_TILE_TYPES.items() if tile_type == header[16]), 'PNG')
+        directories = [(root_offset, root_length)]
+        while directories:
+            offset, length = directories.pop(0)
+            pmtiles_file.seek(offset)
+            for tile_id, run_length, entry_offset, entry_length in deserialize_directory(pmtiles_file.read(length)):
+                if run_length == 0:
+                    directories.append((leaf_offset + entry_offset, entry_length))
+                    continue
+                pmtiles_file.seek(data_offset + entry_offset)
+                tile_data = pmtiles_file.read(entry_length)
+                for run_tile_id in range(tile_id, tile_id + run_length):
+                    z, x, y = tile_id_zxy(run_tile_id)
+                    yield z, x, y, tile_data, image_format
+
+
+class PMTilesWriter:
+    def __init__(self, path, extent_wgs84, zoom_levels, image_format='PNG'):
+        self.path = path
+        self.extent_wgs84 = extent_wgs84
+        self.zoom_levels = list(zoom_levels)
+        self.image_format = image_format
+        self.tile_formats = set()
+        self.tiles_written = 0
+        self.duplicates_written = 0
+        self.tile_contents = {}
+        self.content_spans = []
+        self.tile_ids = {}
+        self.spool_path = path + PMTILES_SPOOL_SUFFIX
+        self.spool_file = open(self.spool_path, 'wb')
+        self.spool_size = 0
+
+    def writeTile(self, z, x, y, image_bytes, image_format=None, uniform=False):
+        self.tile_formats.add(image_format or self.image_format)
+        content_hash = hashlib.sha1(image_bytes).digest()
+        content_index = self.tile_contents.get(content_hash)
+        if content_index is None:
+            content_index = len(self.content_spans)
+            self.tile_contents[content_hash] = content_index
+            self.content_spans.append((self.spool_size, len(image_bytes)))
+            self.spool_file.write(image_bytes)
+            self.spool_size += len(image_bytes)
+        else:
+            self.duplicates_written += 1
+        self.tile_ids[zxy_tile_id(z, x, y)] = content_index
+        self.tiles_written += 1
+
+    def clusteredEntries(self):
+        entries = []
+        data_order = []
+        data_offsets = {}
+        data_size = 0
+        for tile_id in sorted(self.tile_ids):
+            content_index = self.tile_ids[tile_id]
+            if entries and entries[-1][0] + entries[-1][1] == tile_id and entries[-1][4] == content_index:
+                entries[-1][1] += 1
+                continue
+            offset = data_offsets.get(content_index)
+            if offset is None:
+                offset = data_offsets[content_index] = data_size
+                data_order.append(content_index)
+                data_size += self.content_spans[content_index][1]
+            entries.append([tile_id, 1, offset, self.content_spans[content_index][1], content_index])
+        return [tuple(entry[:4]) for entry in entries], data_order, data_size
+
+    def packageFormat(self):
+        return next(iter(self.tile_formats)) if len(self.tile_formats) == 1 else self.image_format
+
+    def metadata(self):
+        return gzip.compress(json.dumps({
+            'name': os.path.splitext(os.path.basename(self.path))[0],
+            'type': 'baselayer',
+            'description': 'Generator mapy C-GeoPortal',
+            'format': self.packageFormat().lower()
+        }).encode('utf-8'), mtime=0)
+
+    def header(self, root_length, metadata_length, leaves_length, data_length, entries_count):
+        west, south = self.extent_wgs84.xMinimum(), self.extent_wgs84.yMinimum()
+        east, north = self.extent_wgs84.xMaximum(), self.extent_wgs84.yMaximum()
+        min_zoom, max_zoom = min(self.zoom_levels), max(self.zoom_levels)
+        tile_type = PMTILES_TILE_TYPES.get(self.packageFormat(), PMTILES_TILE_TYPE_UNKNOWN) if len(self.tile_formats) <= 1 \
+            else PMTILES_TILE_TYPE_UNKNOWN
+        metadata_offset = PMTILES_HEADER_SIZE + root_length
+        leaves_offset = metadata_offset + metadata_length
+        data_offset = leaves_offset + leaves_length
+        return PMTILES_HEADER_STRUCT.pack(
+            PMTILES_MAGIC, PMTILES_VERSION,
+            PMTILES_HEADER_SIZE, root_length, metadata_offset, metadata_length,
+            leaves_offset, leaves_length, data_offset, data_length,
+            len(self.tile_ids), entries_count, len(self.content_spans),
+            1, PMTILES_COMPRESSION_GZIP, PMTILES_COMPRESSION_NONE, tile_type, min_zoom, max_zoom,
+            round(west * 1e7), round(south * 1e7), round(east * 1e7), round(north * 1e7),
+            min_zoom, round((west + east) / 2 * 1e7), round((south + north) / 2 * 1e7))
+
+    def close(self):
+        if self.spool_file is None:
+            return
+        self.spool_file.close()
+        self.spool_file = None
+        try:
+            entries, data_order, data_size = self.clusteredEntries()
+            root, leaves = build_directories(entries)
+            metadata = self.metadata()
+            with open(self.path, 'wb') as pmtiles_file, open(self.spool_path, 'rb') as spool_file:
+                pmtiles_file.write(self.header(len(root), len(metadata), len(leaves), data_size, len(entries)))
+                pmtiles_file.write(root)
+                pmtiles_file.write(metadata)
+                pmtiles_file.write(leaves)
+                for content_index in data_order:
+                    spool_offset, length = self.content_spans[content_index]
+                    spool_file.seek(spool_offset)
+                    while length > 0:
+                        chunk = spool_file.read(min(length, PMTILES_COPY_CHUNK_SIZE))
+                        if not chunk:
+                            raise IOError(f"Niekompletny plik pośredni {self.spool_path}")
+                        pmtiles_file.write(chunk)
+                        length -= len(chunk)
+        finally:
+            os.remove(self.spool_path)
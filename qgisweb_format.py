@@ -0,0 +1,380 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import struct
+import zipfile
+from contextlib import contextmanager
+
+IMAGE_FORMAT_PNG = "PNG"
+IMAGE_FORMAT_WEBP = "WEBP"
+IMAGE_FORMAT_JPEG = "JPEG"
+IMAGE_FORMAT = IMAGE_FORMAT_PNG
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+BASE64_READ_SIZE = 4 * 64 * 1024
+QGISWEB_VERSION = "1"
+QGISWEB_VERSION_DEDUPLICATED = "1.1"
+QGISWEB_VERSION_BINARY = "2"
+QGISWEB_BINARY_MAGIC = b'QGWB'
+QGISWEB_BINARY_FORMATS = (IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, IMAGE_FORMAT_JPEG)
+QGISWEB_BINARY_HEADER = struct.Struct('<4sHI')
+QGISWEB_BINARY_INDEX_ENTRY = struct.Struct('<BIIQIB')
+QGISWEB_BINARY_FOOTER = struct.Struct('<QQ4s')
+QGISWEB_INDEX_SUFFIX = '.idx'
+QGISWEB_INDEX_MAGIC = b'QGWI'
+QGISWEB_INDEX_VERSION = 1
+QGISWEB_INDEX_HEADER = struct.Struct('<4sHH')
+QGISWEB_INDEX_ZOOM = struct.Struct('<BIIIIQ')
+QGISWEB_INDEX_RECORD = struct.Struct('<QI')
+QGISWEB_TILES_KEY = '"tiles": ['
+DEDUPLICATION_MAX_PAYLOAD = 8 * 1024
+UNIFORM_PAYLOAD_CACHE_SIZE = 1024
+
+
+def format_coord_for_json(coord):
+    if coord is None or math.isnan(coord) or math.isinf(coord):
+        return "0,00000000"
+    formatted = "{:.8f}".format(coord)
+    return formatted.replace('.', ',')
+
+
+def qgisweb_params(extent_wgs84):
+    return {
+        'extent': {
+            'lon_min': format_coord_for_json(extent_wgs84.xMinimum()),
+            'lon_max': format_coord_for_json(extent_wgs84.xMaximum()),
+            'lat_min': format_coord_for_json(extent_wgs84.yMinimum()),
+            'lat_max': format_coord_for_json(extent_wgs84.yMaximum()),
+            'dxy': '0',
+            'dh': '0',
+            'epsg': '0'
+        }
+    }
+
+
+class Base64StreamWriter:
+    def __init__(self, output_stream, chunk_size=BASE64_CHUNK_SIZE):
+        self.output_stream = output_stream
+        self.chunk_size = chunk_size - chunk_size % 3
+        self.pending = bytearray()
+        self.position = 0
+
+    def write(self, text):
+        encoded_text = text.encode('utf-8')
+        self.pending += encoded_text
+        self.position += len(encoded_text)
+        if len(self.pending) >= self.chunk_size:
+            aligned_length = len(self.pending) - len(self.pending) % 3
+            self.output_stream.write(base64.b64encode(self.pending[:aligned_length]))
+            del self.pending[:aligned_length]
+
+    def close(self):
+        if self.pending:
+            self.output_stream.write(base64.b64encode(self.pending))
+            self.pending = bytearray()
+
+
+class QgisWebWriter:
+    def __init__(self, output_stream, extent_wgs84, deduplicate=False, image_format=IMAGE_FORMAT, tile_index=None):
+        self.stream = Base64StreamWriter(output_stream)
+        self.image_format = image_format
+        self.tile_index = tile_index
+        self.tiles_written = 0
+        self.deduplicate = deduplicate
+        self.payload_entries = {}
+        self.uniform_payloads = {}
+        self.duplicates_written = 0
+        params = qgisweb_params(extent_wgs84)
+        if deduplicate:
+            self.stream.write(f'{{"version": "{QGISWEB_VERSION_DEDUPLICATED}", ')
+        else:
+            self.stream.write('{')
+        self.stream.write(f'"params": {json.dumps(params)}, {QGISWEB_TILES_KEY}')
+
+    def writeTile(self, z, x, y, image_bytes, image_format=None, uniform=False):
+        tile_entry = {'x': str(x), 'y': str(y), 'z': str(z)}
+        image_format = image_format or self.image_format
+        if image_format != IMAGE_FORMAT_PNG:
+            tile_entry['f'] = image_format.lower()
+        payload_digest = None
+        if self.deduplicate and len(image_bytes) <= DEDUPLICATION_MAX_PAYLOAD:
+            payload_digest = hashlib.sha1(image_bytes).digest()
+        payload_span = None
+        if payload_digest in self.payload_entries:
+            payload_entry, payload_span = self.payload_entries[payload_digest]
+            tile_entry['r'] = str(payload_entry)
+            self.duplicates_written += 1
+        else:
+            tile_entry['t'] = self.encodePayload(image_bytes, uniform)
+        if self.tiles_written > 0:
+            self.stream.write(', ')
+        entry_text = json.dumps(tile_entry)
+        entry_start = self.stream.position
+        self.stream.write(entry_text)
+        if payload_span is None:
+            payload_span = (entry_start, len(entry_text))
+            if payload_digest is not None:
+                self.payload_entries[payload_digest] = (self.tiles_written, payload_span)
+        if self.tile_index is not None:
+            self.tile_index.addTile(z, x, y, *payload_span)
+        self.tiles_written += 1
+
+    def encodePayload(self, image_bytes, uniform=False):
+        encoded_payload = self.uniform_payloads.get(image_bytes) if uniform else None
+        if encoded_payload is None:
+            encoded_payload = base64.b64encode(image_bytes).decode('utf-8')
+            if uniform and len(self.uniform_payloads) < UNIFORM_PAYLOAD_CACHE_SIZE:
+                self.uniform_payloads[image_bytes] = encoded_payload
+        return encoded_payload
+
+    def close(self):
+        self.stream.write(']}')
+        self.stream.close()
+
+
+class QgisWebBinaryWriter:
+    def __init__(self, output_stream, extent_wgs84, deduplicate=False, image_format=IMAGE_FORMAT):
+        self.output_stream = output_stream
+        self.image_format = image_format
+        self.tiles_written = 0
+        self.deduplicate = deduplicate
+        self.payload_spans = {}
+        self.duplicates_written = 0
+        self.index = bytearray()
+        header = {'version': QGISWEB_VERSION_BINARY, 'params': qgisweb_params(extent_wgs84), 'format': image_format.lower()}
+        header_bytes = json.dumps(header).encode('utf-8')
+        self.output_stream.write(QGISWEB_BINARY_HEADER.pack(QGISWEB_BINARY_MAGIC, int(QGISWEB_VERSION_BINARY), len(header_bytes)))
+        self.output_stream.write(header_bytes)
+        self.position = QGISWEB_BINARY_HEADER.size + len(header_bytes)
+
+    def writeTile(self, z, x, y, image_bytes, image_format=None, uniform=False):
+        format_code = QGISWEB_BINARY_FORMATS.index(image_format or self.image_format)
+        payload_digest = None
+        if self.deduplicate and len(image_bytes) <= DEDUPLICATION_MAX_PAYLOAD:
+            payload_digest = hashlib.sha1(image_bytes).digest()
+        payload_span = self.payload_spans.get(payload_digest)
+        if payload_span is not None:
+            self.duplicates_written += 1
+        else:
+            payload_span = (self.position, len(image_bytes))
+            if payload_digest is not None:
+                self.payload_spans[payload_digest] = payload_span
+            self.output_stream.write(image_bytes)
+            self.position += len(image_bytes)
+        self.index += QGISWEB_BINARY_INDEX_ENTRY.pack(z, x, y, payload_span[0], payload_span[1], format_code)
+        self.tiles_written += 1
+
+    def close(self):
+        self.output_stream.write(self.index)
+        self.output_stream.write(QGISWEB_BINARY_FOOTER.pack(self.position, self.tiles_written, QGISWEB_BINARY_MAGIC))
+        self.index = bytearray()
+
+
+class QgisWebIndexWriter:
+    def __init__(self, path, tile_ranges_per_zoom):
+        self.path = path
+        self.zoom_ranges = {}
+        zoom_ranges = sorted((z, z_tile_range) for z, z_tile_range in tile_ranges_per_zoom.items() if z_tile_range is not None)
+        records_offset = QGISWEB_INDEX_HEADER.size + len(zoom_ranges) * QGISWEB_INDEX_ZOOM.size
+        self.index_file = open(path, 'w+b')
+        self.index_file.write(QGISWEB_INDEX_HEADER.pack(QGISWEB_INDEX_MAGIC, QGISWEB_INDEX_VERSION, len(zoom_ranges)))
+        for z, (min_x, max_x, min_y, max_y) in zoom_ranges:
+            cols, rows = max_x - min_x + 1, max_y - min_y + 1
+            self.index_file.write(QGISWEB_INDEX_ZOOM.pack(z, min_x, min_y, cols, rows, records_offset))
+            self.zoom_ranges[z] = (min_x, min_y, cols, rows, records_offset)
+            records_offset += cols * rows * QGISWEB_INDEX_RECORD.size
+        self.index_file.truncate(records_offset)
+
+    def addTile(self, z, x, y, start, length):
+        if z not in self.zoom_ranges:
+            return
+        min_x, min_y, cols, rows, records_offset = self.zoom_ranges[z]
+        if not (0 <= x - min_x < cols and 0 <= y - min_y < rows):
+            return
+        base64_start = start // 3 * 4
+        base64_end = (start + length + 2) // 3 * 4
+        self.index_file.seek(records_offset + ((y - min_y) * cols + x - min_x) * QGISWEB_INDEX_RECORD.size)
+        self.index_file.write(QGISWEB_INDEX_RECORD.pack(base64_start, base64_end - base64_start))
+
+    def close(self):
+        if not self.index_file.closed:
+            self.index_file.close()
+
+
+@contextmanager
+def open_qgisweb_stream(path):
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as arch:
+            member = next((name for name in arch.namelist() if name.endswith('.qgisweb')), arch.namelist()[0])
+            with arch.open(member) as input_stream:
+                yield input_stream
+    else:
+        with open(path, 'rb') as input_stream:
+            yield input_stream
+
+
+def decode_base64_stream(input_stream, read_size=BASE64_READ_SIZE):
+    pending = b''
+    while True:
+        chunk = input_stream.read(read_size)
+        if not chunk:
+            break
+        pending += chunk
+        aligned_length = len(pending) - len(pending) % 4
+        yield base64.b64decode(pending[:aligned_length])
+        pending = pending[aligned_length:]
+    if pending:
+        yield base64.b64decode(pending)
+
+
+def is_qgisweb_binary(path):
+    with open_qgisweb_stream(path) as input_stream:
+        return input_stream.read(len(QGISWEB_BINARY_MAGIC)) == QGISWEB_BINARY_MAGIC
+
+
+class QgisWebReader:
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.params = None
+
+    def readHeader(self):
+        entries = self.entries()
+        next(entries, None)
+        entries.close()
+        return self.params
+
+    def entries(self):
+        decoder = json.JSONDecoder()
+        with open_qgisweb_stream(self.path) as input_stream:
+            chunks = decode_base64_stream(input_stream)
+            text = ''
+            while QGISWEB_TILES_KEY not in text:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    raise ValueError(f"Nieprawidłowy plik {self.path}: brak listy kafli")
+                text += chunk.decode('ascii')
+            header_end = text.index(QGISWEB_TILES_KEY)
+            header = json.loads(text[:header_end] + '"tiles": []}')
+            self.version = header.get('version', QGISWEB_VERSION)
+            self.params = header.get('params')
+            text = text[header_end + len(QGISWEB_TILES_KEY):]
+            position = 0
+            finished = False
+            while True:
+                while position < len(text) and text[position] in ', ':
+                    position += 1
+                if position < len(text):
+                    if text[position] == ']':
+                        return
+                    try:
+                        entry, position = decoder.raw_decode(text, position)
+                        yield entry
+                        continue
+                    except json.JSONDecodeError:
+                        if finished:
+                            raise
+                elif finished:
+                    raise ValueError(f"Nieprawidłowy plik {self.path}: niezakończona lista kafli")
+                text = text[position:]
+                position = 0
+                chunk = next(chunks, None)
+                if chunk is None:
+                    finished = True
+                else:
+                    text += chunk.decode('ascii')
+
+    def tiles(self):
+        self.readHeader()
+        referenced_entries = set()
+        if self.version == QGISWEB_VERSION_DEDUPLICATED:
+            referenced_entries = {int(entry['r']) for entry in self.entries() if 'r' in entry}
+        shared_payloads = {}
+        for index, entry in enumerate(self.entries()):
+            if 'r' in entry:
+                image_bytes = shared_payloads[int(entry['r'])]
+            else:
+                image_bytes = base64.b64decode(entry['t'])
+                if index in referenced_entries:
+                    shared_payloads[index] = image_bytes
+            yield int(entry['z']), int(entry['x']), int(entry['y']), image_bytes, entry.get('f', IMAGE_FORMAT).upper()
+
+
+class QgisWebBinaryReader:
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.params = None
+        self.tile_index = None
+
+    def readIndex(self, input_stream):
+        magic, version, header_length = QGISWEB_BINARY_HEADER.unpack(input_stream.read(QGISWEB_BINARY_HEADER.size))
+        if magic != QGISWEB_BINARY_MAGIC or str(version) != QGISWEB_VERSION_BINARY:
+            raise ValueError(f"Nieprawidłowy plik {self.path}: nieobsługiwana wersja pakietu")
+        header = json.loads(input_stream.read(header_length))
+        self.version = header['version']
+        self.params = header['params']
+        input_stream.seek(-QGISWEB_BINARY_FOOTER.size, os.SEEK_END)
+        index_offset, tile_count, footer_magic = QGISWEB_BINARY_FOOTER.unpack(input_stream.read(QGISWEB_BINARY_FOOTER.size))
+        if footer_magic != QGISWEB_BINARY_MAGIC:
+            raise ValueError(f"Nieprawidłowy plik {self.path}: brak indeksu kafli")
+        input_stream.seek(index_offset)
+        return list(QGISWEB_BINARY_INDEX_ENTRY.iter_unpack(input_stream.read(tile_count * QGISWEB_BINARY_INDEX_ENTRY.size)))
+
+    def readHeader(self):
+        with open_qgisweb_stream(self.path) as input_stream:
+            self.readIndex(input_stream)
+        return self.params
+
+    def readTile(self, z, x, y):
+        with open_qgisweb_stream(self.path) as input_stream:
+            if self.tile_index is None:
+                self.tile_index = {(tz, tx, ty): (offset, length, format_code) for tz, tx, ty, offset, length, format_code in self.readIndex(input_stream)}
+            tile_span = self.tile_index.get((z, x, y))
+            if tile_span is None:
+                return None
+            offset, length, format_code = tile_span
+            input_stream.seek(offset)
+            return input_stream.read(length), QGISWEB_BINARY_FORMATS[format_code]
+
+    def tiles(self):
+        with open_qgisweb_stream(self.path) as input_stream:
+            tile_index = sorted(self.readIndex(input_stream), key=lambda entry: entry[3])
+            last_span = None
+            image_bytes = b''
+            for z, x, y, offset, length, format_code in tile_index:
+                if (offset, length) != last_span:
+                    input_stream.seek(offset)
+                    image_bytes = input_stream.read(length)
+                    last_span = (offset, length)
+                yield z, x, y, image_bytes, QGISWEB_BINARY_FORMATS[format_code]
+
+
+class QgisWebIndexReader:
+    def __init__(self, index_path, package_path):
+        self.index_path = index_path
+        self.package_path = package_path
+
+    def tileSpan(self, z, x, y):
+        with open(self.index_path, 'rb') as index_file:
+            magic, version, zoom_count = QGISWEB_INDEX_HEADER.unpack(index_file.read(QGISWEB_INDEX_HEADER.size))
+            if magic != QGISWEB_INDEX_MAGIC or version != QGISWEB_INDEX_VERSION:
+                raise ValueError(f"Nieprawidłowy plik {self.index_path}: nieobsługiwana wersja indeksu")
+            for index_z, min_x, min_y, cols, rows, records_offset in QGISWEB_INDEX_ZOOM.iter_unpack(index_file.read(zoom_count * QGISWEB_INDEX_ZOOM.size)):
+                if index_z == z and 0 <= x - min_x < cols and 0 <= y - min_y < rows:
+                    index_file.seek(records_offset + ((y - min_y) * cols + x - min_x) * QGISWEB_INDEX_RECORD.size)
+                    base64_start, base64_length = QGISWEB_INDEX_RECORD.unpack(index_file.read(QGISWEB_INDEX_RECORD.size))
+                    return (base64_start, base64_length) if base64_length > 0 else None
+        return None
+
+    def readTile(self, z, x, y):
+        tile_span = self.tileSpan(z, x, y)
+        if tile_span is None:
+            return None
+        base64_start, base64_length = tile_span
+        with open_qgisweb_stream(self.package_path) as input_stream:
+            input_stream.seek(base64_start)
+            text = base64.b64decode(input_stream.read(base64_length)).decode('ascii')
+        entry, _ = json.JSONDecoder().raw_decode(text, text.index('{'))
+        return base64.b64decode(entry['t']), entry.get('f', IMAGE_FORMAT).upper()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Extent:
+    def __init__(self, west, south, east, north):
+        self.west, self.south, self.east, self.north = west, south, east, north
+
+    def xMinimum(self):
+        return self.west
+
+    def yMinimum(self):
+        return self.south
+
+    def xMaximum(self):
+        return self.east
+
+    def yMaximum(self):
+        return self.north
+
+
+@pytest.fixture
+def extent():
+    return Extent(14.12, 49.0, 24.15, 54.84)
@@ -0,0 +1,63 @@
+import sqlite3
+
+from mbtiles_writer import MBTilesWriter, mbtiles_tiles
+
+
+def write_package(path, extent, tiles, image_format='PNG'):
+    writer = MBTilesWriter(path, extent, sorted({z for z, x, y in tiles}), image_format)
+    for (z, x, y), (image_bytes, tile_format) in tiles.items():
+        writer.writeTile(z, x, y, image_bytes, tile_format)
+    writer.close()
+    return writer
+
+
+def read_metadata(path):
+    connection = sqlite3.connect(path)
+    try:
+        return dict(connection.execute('SELECT name, value FROM metadata').fetchall())
+    finally:
+        connection.close()
+
+
+def test_roundtrip(tmp_path, extent):
+    path = str(tmp_path / 'mapa.mbtiles')
+    tiles = {}
+    for z in (4, 5):
+        for x in range(8, 8 + z):
+            for y in range(4, 4 + z):
+                tiles[(z, x, y)] = (b'water' if y == 4 else bytes([z, x, y]) * 20, 'PNG')
+    writer = write_package(path, extent, tiles)
+    assert writer.tiles_written == len(tiles)
+    assert writer.duplicates_written == 8
+
+    assert {(z, x, y): (image_bytes, image_format) for z, x, y, image_bytes, image_format in mbtiles_tiles(path)} == tiles
+    metadata = read_metadata(path)
+    assert metadata['format'] == 'png'
+    assert (metadata['minzoom'], metadata['maxzoom']) == ('4', '5')
+    assert metadata['bounds'] == '14.12000000,49.00000000,24.15000000,54.84000000'
+    connection = sqlite3.connect(path)
+    try:
+        assert connection.execute('SELECT tile_row FROM tiles WHERE zoom_level = 4 AND tile_column = 8 '
+                                  'ORDER BY tile_row DESC').fetchone() == ((1 << 4) - 1 - 4,)
+    finally:
+        connection.close()
+
+
+def test_format_of_written_tiles(tmp_path, extent):
+    path = str(tmp_path / 'mapa.mbtiles')
+    tiles = {(6, x, 20): (bytes([x]) * 10, 'JPEG') for x in range(30, 34)}
+    write_package(path, extent, tiles, 'PNG')
+    assert read_metadata(path)['format'] == 'jpg'
+    assert {image_format for z, x, y, image_bytes, image_format in mbtiles_tiles(path)} == {'JPEG'}
+
+
+def test_stale_wal_files_removed(tmp_path, extent):
+    path = str(tmp_path / 'mapa.mbtiles')
+    for stale_path in (path, path + '-wal', path + '-shm'):
+        with open(stale_path, 'wb') as stale_file:
+            stale_file.write(b'stale')
+    tiles = {(3, 4, 2): (b'tile', 'PNG')}
+    write_package(path, extent, tiles)
+    assert not (tmp_path / 'mapa.mbtiles-wal').exists()
+    assert not (tmp_path / 'mapa.mbtiles-shm').exists()
+    assert {(z, x, y): (image_bytes, image_format) for z, x, y, image_bytes, image_format in mbtiles_tiles(path)} == tiles
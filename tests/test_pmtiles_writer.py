@@ -0,0 +1,73 @@
+import struct
+
+import pytest
+
+import pmtiles_writer
+from pmtiles_writer import PMTILES_HEADER_SIZE, PMTILES_HEADER_STRUCT, PMTilesWriter, pmtiles_tiles, tile_id_zxy, \
+    zxy_tile_id
+
+
+@pytest.mark.parametrize('zxy, tile_id', [
+    ((0, 0, 0), 0),
+    ((1, 0, 0), 1),
+    ((1, 0, 1), 2),
+    ((1, 1, 1), 3),
+    ((1, 1, 0), 4),
+    ((2, 0, 0), 5),
+    ((3, 0, 0), 21),
+    ((12, 3423, 1763), 19078479),
+])
+def test_tile_id_matches_spec(zxy, tile_id):
+    assert zxy_tile_id(*zxy) == tile_id
+    assert tile_id_zxy(tile_id) == zxy
+
+
+def test_tile_id_roundtrip():
+    for z in range(6):
+        tile_ids = {zxy_tile_id(z, x, y) for x in range(1 << z) for y in range(1 << z)}
+        assert tile_ids == set(range(((1 << (2 * z)) - 1) // 3, ((1 << (2 * (z + 1))) - 1) // 3))
+        for tile_id in tile_ids:
+            assert zxy_tile_id(*tile_id_zxy(tile_id)) == tile_id
+
+
+def test_roundtrip_with_leaf_directories(tmp_path, monkeypatch, extent):
+    monkeypatch.setattr(pmtiles_writer, 'PMTILES_ROOT_DIRECTORY_MAX_SIZE', 64)
+    monkeypatch.setattr(pmtiles_writer, 'PMTILES_LEAF_DIRECTORY_MIN_ENTRIES', 16)
+    path = str(tmp_path / 'tiles.pmtiles')
+    writer = PMTilesWriter(path, extent, [6, 7])
+    tiles = {}
+    for z, cols, rows in ((6, 8, 8), (7, 32, 16)):
+        for x in range(cols):
+            for y in range(rows):
+                image_bytes = b'sea' if x < 2 else struct.pack('<BII', z, x, y)
+                writer.writeTile(z, x, y, image_bytes)
+                tiles[(z, x, y)] = image_bytes
+    writer.close()
+
+    with open(path, 'rb') as pmtiles_file:
+        header = PMTILES_HEADER_STRUCT.unpack(pmtiles_file.read(PMTILES_HEADER_SIZE))
+    assert header[7] > 0
+    assert header[10] == len(tiles)
+    assert header[12] == len(set(tiles.values()))
+    assert (header[17], header[18]) == (6, 7)
+
+    read_tiles = {}
+    for z, x, y, image_bytes, image_format in pmtiles_tiles(path):
+        assert (z, x, y) not in read_tiles
+        assert image_format == 'PNG'
+        read_tiles[(z, x, y)] = image_bytes
+    assert read_tiles == tiles
+    assert writer.duplicates_written == sum(1 for image_bytes in tiles.values() if image_bytes == b'sea') - 1
+
+
+def test_tile_type_of_written_tiles(tmp_path, extent):
+    path = str(tmp_path / 'tiles.pmtiles')
+    writer = PMTilesWriter(path, extent, [6], 'PNG')
+    for x in range(30, 34):
+        writer.writeTile(6, x, 20, bytes([x]) * 10, 'JPEG')
+    writer.close()
+
+    with open(path, 'rb') as pmtiles_file:
+        header = PMTILES_HEADER_STRUCT.unpack(pmtiles_file.read(PMTILES_HEADER_SIZE))
+    assert header[16] == pmtiles_writer.PMTILES_TILE_TYPES['JPEG']
+    assert {image_format for z, x, y, image_bytes, image_format in pmtiles_tiles(path)} == {'JPEG'}
@@ -0,0 +1,59 @@
+import zipfile
+
+from qgisweb_format import IMAGE_FORMAT_JPEG, IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, QGISWEB_VERSION_BINARY, \
+    QgisWebBinaryReader, QgisWebBinaryWriter, is_qgisweb_binary
+
+
+def write_package(path, extent, tiles):
+    with open(path, 'wb') as output_stream:
+        writer = QgisWebBinaryWriter(output_stream, extent, deduplicate=True)
+        for (z, x, y), (image_bytes, image_format) in tiles.items():
+            writer.writeTile(z, x, y, image_bytes, image_format)
+        writer.close()
+    return writer
+
+
+def sample_tiles():
+    tiles = {}
+    for x in range(4):
+        for y in range(3):
+            tiles[(3, x, y)] = (bytes([x, y]) * 50, IMAGE_FORMAT_PNG)
+    tiles[(4, 8, 5)] = (b'\xff\xd8jpeg', IMAGE_FORMAT_JPEG)
+    tiles[(4, 8, 6)] = (b'RIFFwebp', IMAGE_FORMAT_WEBP)
+    for y in range(7, 12):
+        tiles[(4, 9, y)] = (b'empty', IMAGE_FORMAT_PNG)
+    return tiles
+
+
+def test_roundtrip(tmp_path, extent):
+    path = str(tmp_path / 'mapa.qgisweb')
+    tiles = sample_tiles()
+    writer = write_package(path, extent, tiles)
+    assert writer.tiles_written == len(tiles)
+    assert writer.duplicates_written == 4
+    assert is_qgisweb_binary(path)
+
+    reader = QgisWebBinaryReader(path)
+    params = reader.readHeader()
+    assert reader.version == QGISWEB_VERSION_BINARY
+    assert params['extent']['lon_min'] == '14,12000000'
+    assert params['extent']['lat_max'] == '54,84000000'
+    read_tiles = {(z, x, y): (image_bytes, image_format) for z, x, y, image_bytes, image_format in reader.tiles()}
+    assert read_tiles == tiles
+    assert reader.readTile(4, 8, 6) == tiles[(4, 8, 6)]
+    assert reader.readTile(4, 9, 11) == tiles[(4, 9, 11)]
+    assert reader.readTile(5, 0, 0) is None
+
+
+def test_roundtrip_from_zip(tmp_path, extent):
+    path = str(tmp_path / 'mapa.qgisweb')
+    tiles = sample_tiles()
+    write_package(path, extent, tiles)
+    zip_path = str(tmp_path / 'mapa.zip')
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as arch:
+        arch.write(path, 'mapa.qgisweb')
+
+    assert is_qgisweb_binary(zip_path)
+    reader = QgisWebBinaryReader(zip_path)
+    assert {(z, x, y): (image_bytes, image_format) for z, x, y, image_bytes, image_format in reader.tiles()} == tiles
+    assert reader.readTile(3, 2, 1) == tiles[(3, 2, 1)]
@@ -0,0 +1,36 @@
+from qgisweb_format import IMAGE_FORMAT_JPEG, IMAGE_FORMAT_PNG, QGISWEB_INDEX_SUFFIX, QGISWEB_VERSION_DEDUPLICATED, \
+    QgisWebIndexReader, QgisWebIndexWriter, QgisWebReader, QgisWebWriter
+
+
+def test_read_tiles_through_index_from_deduplicated_package(tmp_path, extent):
+    path = str(tmp_path / 'mapa.qgisweb')
+    index_path = path + QGISWEB_INDEX_SUFFIX
+    tile_ranges = {5: (16, 19, 9, 12), 6: (32, 39, 18, 25)}
+    tiles = {}
+    for z, (min_x, max_x, min_y, max_y) in tile_ranges.items():
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                if (x + y) % 3 == 0:
+                    tiles[(z, x, y)] = (b'water', IMAGE_FORMAT_PNG)
+                elif (x, y) != (min_x, min_y):
+                    tiles[(z, x, y)] = (bytes([z, x, y]) * (x + y), IMAGE_FORMAT_JPEG if x % 2 else IMAGE_FORMAT_PNG)
+
+    tile_index = QgisWebIndexWriter(index_path, tile_ranges)
+    with open(path, 'wb') as output_stream:
+        writer = QgisWebWriter(output_stream, extent, deduplicate=True, tile_index=tile_index)
+        for (z, x, y), (image_bytes, image_format) in tiles.items():
+            writer.writeTile(z, x, y, image_bytes, image_format, uniform=image_bytes == b'water')
+        writer.close()
+    tile_index.close()
+    assert writer.duplicates_written > 0
+
+    reader = QgisWebReader(path)
+    assert {(z, x, y): (image_bytes, image_format) for z, x, y, image_bytes, image_format in reader.tiles()} == tiles
+    assert reader.version == QGISWEB_VERSION_DEDUPLICATED
+
+    index_reader = QgisWebIndexReader(index_path, path)
+    for (z, x, y), tile in tiles.items():
+        assert index_reader.readTile(z, x, y) == tile
+    assert index_reader.readTile(5, 16, 9) is None
+    assert index_reader.readTile(5, 20, 9) is None
+    assert index_reader.readTile(7, 64, 36) is None
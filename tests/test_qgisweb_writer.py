@@ -0,0 +1,35 @@
+import base64
+import hashlib
+import io
+import json
+
+import pytest
+
+from qgisweb_format import BASE64_CHUNK_SIZE, QgisWebWriter, qgisweb_params
+
+
+def tile_payload(index, size):
+    payload = b''
+    while len(payload) < size:
+        payload += hashlib.sha1(f'{index}:{len(payload)}'.encode('utf-8')).digest()
+    return payload[:size]
+
+
+@pytest.mark.parametrize('tile_count, payload_size', [(0, 0), (1, 700), (400, 1500)])
+def test_output_matches_single_base64_document(extent, tile_count, payload_size):
+    tiles = [(12, 2200 + index % 20, 1380 + index // 20, tile_payload(index, payload_size)) for index in range(tile_count)]
+    output_stream = io.BytesIO()
+    writer = QgisWebWriter(output_stream, extent)
+    for z, x, y, image_bytes in tiles:
+        writer.writeTile(z, x, y, image_bytes)
+    writer.close()
+
+    document = {
+        'params': qgisweb_params(extent),
+        'tiles': [{'x': str(x), 'y': str(y), 'z': str(z), 't': base64.b64encode(image_bytes).decode('utf-8')}
+                  for z, x, y, image_bytes in tiles]
+    }
+    expected = base64.b64encode(json.dumps(document).encode('utf-8'))
+    assert output_stream.getvalue() == expected
+    if tile_count > 1:
+        assert len(expected) > 2 * BASE64_CHUNK_SIZE
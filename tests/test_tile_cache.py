@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+pytest.importorskip('qgis.core')
+
+from tile_cache import layer_source_files
+
+
+class Layer:
+    def __init__(self, source, provider_type='ogr'):
+        self.layer_source = source
+        self.provider_type = provider_type
+
+    def source(self):
+        return self.layer_source
+
+    def providerType(self):
+        return self.provider_type
+
+
+def create_files(directory, *names):
+    for name in names:
+        with open(os.path.join(directory, name), 'wb') as data_file:
+            data_file.write(b'data')
+    return [os.path.join(directory, name) for name in names]
+
+
+def test_shapefile_companions_only(tmp_path):
+    companions = create_files(str(tmp_path), 'siec.shp', 'siec.shx', 'siec.dbf', 'siec.prj', 'siec.cpg')
+    create_files(str(tmp_path), 'siec.qgisweb', 'siec.qgisweb.spool', 'siec.qgisweb.idx', 'siec.txt', 'siec.shp.xml')
+    assert layer_source_files(Layer(os.path.join(str(tmp_path), 'siec.shp'))) == sorted(companions)
+
+
+def test_geopackage_with_wal(tmp_path):
+    source_path, wal_path = create_files(str(tmp_path), 'siec.gpkg', 'siec.gpkg-wal')
+    create_files(str(tmp_path), 'siec.gpkg-shm', 'siec.qgisweb', 'siec.qgisweb.fingerprint', 'siec.mbtiles-wal')
+    assert layer_source_files(Layer(source_path + '|layername=drogi')) == [source_path, wal_path]
+
+
+def test_raster_source_file_only(tmp_path):
+    source_path, = create_files(str(tmp_path), 'ortofoto.tif')
+    create_files(str(tmp_path), 'ortofoto.qgisweb', 'ortofoto.qgisweb.spool', 'ortofoto.pmtiles')
+    assert layer_source_files(Layer(source_path, 'gdal')) == [source_path]
+
+
+def test_missing_source(tmp_path):
+    assert layer_source_files(Layer(os.path.join(str(tmp_path), 'brak.gpkg'))) == []
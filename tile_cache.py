@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from qgis.core import QgsMapLayerStyle, QgsVectorLayer
+
+CACHE_COMMIT_INTERVAL = 5.0
+CACHE_MAX_AGE = 30 * 24 * 3600
+CACHE_MAX_SIZE = 2 * 1024 * 1024 * 1024
+TRACKED_DATA_PROVIDERS = ('ogr', 'gdal')
+SHAPEFILE_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj', '.cpg')
+SQLITE_EXTENSIONS = ('.gpkg', '.sqlite', '.db')
+SQLITE_WAL_SUFFIX = '-wal'
+
+
+def layer_style_fingerprint(layer):
+    style = QgsMapLayerStyle()
+    style.readFromLayer(layer)
+    return hashlib.sha1(style.xmlData().encode('utf-8')).hexdigest()
+
+
+def layer_source_files(layer):
+    source_path = layer.source().split('|')[0]
+    if not os.path.isfile(source_path):
+        return []
+    stem, extension = os.path.splitext(source_path)
+    if layer.providerType() == 'ogr' and extension.lower() == '.shp':
+        candidates = [stem + companion for shapefile_extension in SHAPEFILE_EXTENSIONS
+                      for companion in (shapefile_extension, shapefile_extension.upper())]
+    elif extension.lower() in SQLITE_EXTENSIONS:
+        candidates = [source_path + SQLITE_WAL_SUFFIX]
+    else:
+        candidates = []
+    return sorted({source_path, *(path for path in candidates if os.path.isfile(path))})
+
+
+def has_tracked_data_state(layer):
+    if layer.providerType() not in TRACKED_DATA_PROVIDERS or not layer_source_files(layer):
+        return False
+    return not (isinstance(layer, QgsVectorLayer) and layer.isModified())
+
+
+def layer_data_state(layer, ignored_paths=()):
+    data_state = [layer.id(), layer.source(), layer.crs().authid()]
+    for source_file in layer_source_files(layer):
+        if os.path.normcase(os.path.abspath(source_file)) in ignored_paths:
+            continue
+        source_stat = os.stat(source_file)
+        data_state += [os.path.basename(source_file), source_stat.st_mtime_ns, source_stat.st_size]
+    if isinstance(layer, QgsVectorLayer):
+        data_state += [layer.featureCount(), layer.extent().toString(), layer.subsetString()]
+        if layer.isModified():
+            data_state.append(time.time_ns())
+    return data_state
+
+
+def render_fingerprint(layers, render_settings, ignored_paths=()):
+    fingerprint_data = {
+        'layers': [[layer_data_state(layer, ignored_paths), layer_style_fingerprint(layer)] for layer in layers],
+        'render': render_settings
+    }
+    return hashlib.sha1(json.dumps(fingerprint_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class TileCache:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.last_commit = time.monotonic()
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS blobs (hash BLOB PRIMARY KEY, data BLOB NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tiles ('
+                                'fingerprint TEXT NOT NULL, z INTEGER NOT NULL, x INTEGER NOT NULL, y INTEGER NOT NULL, '
+                                'format TEXT NOT NULL, hash BLOB NOT NULL, PRIMARY KEY (fingerprint, z, x, y))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tiles_position ON tiles (z, x, y)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fingerprints (fingerprint TEXT PRIMARY KEY, last_used REAL NOT NULL)')
+        self.connection.commit()
+
+    def touch(self, fingerprints):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO fingerprints (fingerprint, last_used) VALUES (?, ?)',
+                                        [(fingerprint, now) for fingerprint in fingerprints])
+            self.connection.commit()
+
+    def invalidate(self, z, tiles):
+        with self.lock:
+            self.connection.executemany('DELETE FROM tiles WHERE z = ? AND x = ? AND y = ?', [(z, x, y) for x, y in tiles])
+            self.connection.commit()
+
+    def prune(self, keep=(), max_age=CACHE_MAX_AGE, max_size=CACHE_MAX_SIZE):
+        with self.lock:
+            self.connection.execute('DELETE FROM fingerprints WHERE last_used < ?', (time.time() - max_age,))
+            self.connection.execute('DELETE FROM tiles WHERE fingerprint NOT IN (SELECT fingerprint FROM fingerprints)')
+            self.deleteOrphanBlobs()
+            for fingerprint, in self.connection.execute('SELECT fingerprint FROM fingerprints ORDER BY last_used').fetchall():
+                if self.cacheSize() <= max_size:
+                    break
+                if fingerprint in keep:
+                    continue
+                self.connection.execute('DELETE FROM tiles WHERE fingerprint = ?', (fingerprint,))
+                self.connection.execute('DELETE FROM fingerprints WHERE fingerprint = ?', (fingerprint,))
+                self.deleteOrphanBlobs()
+            self.connection.commit()
+
+    def deleteOrphanBlobs(self):
+        self.connection.execute('DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM tiles)')
+
+    def cacheSize(self):
+        return self.connection.execute('SELECT COALESCE(SUM(LENGTH(data)), 0) FROM blobs').fetchone()[0]
+
+    def lookup(self, fingerprint, z, min_x, max_x, min_y, max_y):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT tiles.x, tiles.y, tiles.format, blobs.data FROM tiles JOIN blobs ON blobs.hash = tiles.hash '
+                'WHERE tiles.fingerprint = ? AND tiles.z = ? AND tiles.x BETWEEN ? AND ? AND tiles.y BETWEEN ? AND ?',
+                (fingerprint, z, min_x, max_x, min_y, max_y)).fetchall()
+        return {(x, y): (bytes(data), image_format) for x, y, image_format, data in rows}
+
+    def store(self, fingerprint, z, tiles):
+        blobs = {}
+        tile_rows = []
+        for x, y, image_bytes, image_format in tiles:
+            payload_hash = hashlib.sha1(image_bytes).digest()
+            blobs[payload_hash] = image_bytes
+            tile_rows.append((fingerprint, z, x, y, image_format, payload_hash))
+        with self.lock:
+            self.connection.executemany('INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)', blobs.items())
+            self.connection.executemany('INSERT OR REPLACE INTO tiles (fingerprint, z, x, y, format, hash) VALUES (?, ?, ?, ?, ?, ?)', tile_rows)
+            if time.monotonic() - self.last_commit >= CACHE_COMMIT_INTERVAL:
+                self.connection.commit()
+                self.last_commit = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
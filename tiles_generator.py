@@ -31,7 +31,10 @@ from .resources.resources import *
 
 from .tiles_generator_dockwidget import TilesGeneratorDockWidget
 from .extent_tool import ExtentTool
-from .generator_task import GeneratorTask
+from .dirty_regions import DirtyRegionTracker
+from .generator_task import GeneratorTask, PYRAMID_RESAMPLING_BOX, PYRAMID_RESAMPLING_LANCZOS, \
+    IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, IMAGE_FORMAT_JPEG, OUTPUT_FORMAT_QGISWEB, OUTPUT_FORMAT_MBTILES, \
+    OUTPUT_FORMAT_PMTILES, OUTPUT_FORMAT_QGISWEB_BINARY
 
 
 class TilesGenerator:
@@ -55,6 +58,8 @@ class TilesGenerator:
 
         self.pluginIsActive = False
         self.dockwidget = None
+        self.dirty_tracker = None
+        self.synced_package = None
 
     def tr(self, message):
         return QCoreApplication.translate('TilesGenerator', message)
@@ -96,6 +101,7 @@ class TilesGenerator:
             text=self.tr(u'Wygeneruj kafle na podstawie treści mapy'),
             callback=self.run,
             parent=self.iface.mainWindow())
+        self.dirty_tracker = DirtyRegionTracker(QgsProject.instance())
 
     def onClosePlugin(self):
         self.dockwidget.closingPlugin.disconnect(self.onClosePlugin)
@@ -107,6 +113,9 @@ class TilesGenerator:
                 self.tr(u'&Generator Mapy C-GeoPortal'),
                 action)
             self.iface.removeToolBarIcon(action)
+        if self.dirty_tracker is not None:
+            self.dirty_tracker.close()
+            self.dirty_tracker = None
 
     def logMessage(self, message, message_level=Qgis.Info, mode='quiet'):
         if mode == 'loud':
@@ -128,6 +137,7 @@ class TilesGenerator:
                 self.dockwidget.draw_extent_btn.clicked.connect(lambda: self.canvas.setMapTool(self.extent_tool))
                 self.dockwidget.generate_tiles_btn.clicked.connect(self.callGeneratorTask)
                 self.dockwidget.cancel_btn.clicked.connect(self.cancelGeneration)
+                self.dockwidget.clear_cache_btn.clicked.connect(self.clearTileCache)
             self.dockwidget.closingPlugin.connect(self.onClosePlugin)
             self.iface.addDockWidget(Qt.RightDockWidgetArea, self.dockwidget)
             self.dockwidget.show()
@@ -174,12 +184,41 @@ class TilesGenerator:
                             transform = QgsCoordinateTransform(project.crs(), params_crs, project)
                             tiles_extent = transform.transformBoundingBox(extent)
                     if not tiles_extent.isNull():
+                        self.generator_task.tiles_path = tiles_path
+                        self.generator_task.zip_pack = self.dockwidget.zip_check.isChecked()
+                        self.generator_task.output_format = [OUTPUT_FORMAT_QGISWEB, OUTPUT_FORMAT_MBTILES, OUTPUT_FORMAT_PMTILES, OUTPUT_FORMAT_QGISWEB_BINARY][self.dockwidget.output_combo.currentIndex()]
+                        package_path = os.path.normcase(os.path.abspath(self.generator_task.outputPath()))
+                        incremental = self.dockwidget.incremental_check.isChecked() and os.path.exists(package_path)
                         self.dockwidget.generate_tiles_btn.setVisible(False)
                         self.dockwidget.cancel_btn.setVisible(True)
                         self.dockwidget.progress_bar.setVisible(True)
                         self.dockwidget.progress_bar.setValue(0)
-                        self.generator_task.tiles_path = tiles_path
-                        self.generator_task.zip_pack = self.dockwidget.zip_check.isChecked()
+                        self.generator_task.render_workers = self.dockwidget.workers_spin.value()
+                        self.generator_task.encode_workers = self.dockwidget.encode_workers_spin.value()
+                        self.generator_task.deduplicate_tiles = self.dockwidget.dedup_check.isChecked()
+                        self.generator_task.palette_png = self.dockwidget.palette_check.isChecked()
+                        format_option = self.dockwidget.format_combo.currentIndex()
+                        self.generator_task.image_format = [IMAGE_FORMAT_PNG, IMAGE_FORMAT_WEBP, IMAGE_FORMAT_WEBP, IMAGE_FORMAT_JPEG, IMAGE_FORMAT_PNG][format_option]
+                        self.generator_task.opaque_image_format = IMAGE_FORMAT_JPEG if format_option == 4 else None
+                        self.generator_task.webp_lossless = format_option == 2
+                        self.generator_task.image_quality = self.dockwidget.quality_spin.value()
+                        self.generator_task.png_compression_level = self.dockwidget.png_level_spin.value()
+                        self.generator_task.resume_generation = self.dockwidget.resume_check.isChecked()
+                        self.generator_task.write_tile_index = self.dockwidget.index_check.isChecked()
+                        self.generator_task.prune_transparent_descendants = self.dockwidget.prune_check.isChecked()
+                        dirty_sequence, dirty_extents = self.dirty_tracker.snapshot(package_path)
+                        self.synced_package = (package_path, dirty_sequence)
+                        self.generator_task.dirty_extents = None
+                        if incremental and not self.dirty_tracker.needsFullRefresh(package_path):
+                            self.generator_task.dirty_extents = dirty_extents
+                        elif incremental:
+                            self.logMessage('Zmieniono styl lub zestaw warstw albo pakiet nie był generowany w tej sesji, pakiet zostanie wygenerowany w całości')
+                        self.generator_task.tile_cache_path = None
+                        if self.dockwidget.cache_check.isChecked():
+                            self.generator_task.tile_cache_path = self.tileCachePath()
+                        pyramid_option = self.dockwidget.pyramid_combo.currentIndex()
+                        self.generator_task.pyramid_mode = pyramid_option > 0
+                        self.generator_task.pyramid_resampling = PYRAMID_RESAMPLING_LANCZOS if pyramid_option == 2 else PYRAMID_RESAMPLING_BOX
                         self.generator_task.layers_to_render = generator_layers
                         self.generator_task.tiles_extent_wgs84 = tiles_extent
                         self.generator_task.zoom_levels = [i for i in range(self.dockwidget.min_slider.value(), self.dockwidget.max_slider.value() + 1)]
@@ -191,13 +230,31 @@ class TilesGenerator:
             else:
                 self.logMessage('Nie wskazano miejsca zapisu pliku kafli', mode='loud')
 
+    def tileCachePath(self):
+        return os.path.join(QgsApplication.qgisSettingsDirPath(), 'tiles_generator', 'tile_cache.sqlite')
+
+    def clearTileCache(self):
+        if self.generator_task.isRunning():
+            self.logMessage('Zadanie generowania kafli w toku', mode='loud')
+            return
+        cache_path = self.tileCachePath()
+        try:
+            for path in (cache_path, cache_path + '-wal', cache_path + '-shm'):
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as e:
+            self.logMessage(f'Nie udało się wyczyścić pamięci podręcznej kafli: {e}', Qgis.Warning, 'loud')
+            return
+        self.logMessage('Pamięć podręczna kafli wyczyszczona', mode='loud')
+
     def cancelGeneration(self):
-        self.generator_task.terminated = True
-        self.generator_task.terminate()
+        self.dockwidget.cancel_btn.setEnabled(False)
+        self.generator_task.cancel()
 
     def generationFinihed(self):
         self.dockwidget.generate_tiles_btn.setVisible(True)
         self.dockwidget.cancel_btn.setVisible(False)
+        self.dockwidget.cancel_btn.setEnabled(True)
         self.dockwidget.progress_bar.setVisible(False)
         if self.generator_task.terminated:
             self.logMessage('Zadanie generowania kafli przerwane', mode='loud')
@@ -205,7 +262,5 @@ class TilesGenerator:
             nl = '\n'
             self.logMessage(f'Zadanie generowania kafli zakończone z następującymi błędami:{nl}{nl.join(self.generator_task.errors)}', Qgis.Warning, 'loud')
         else:
-            tiles_path = self.generator_task.tiles_path
-            if self.generator_task.zip_pack:
-                tiles_path = tiles_path.replace('.qgisweb', '.zip')
-            self.logMessage(f'Zadanie generowania kafli zakończone, wynik zapisany w lokalizacji {tiles_path}', Qgis.Success, 'loud')
+            self.dirty_tracker.markSynced(*self.synced_package)
+            self.logMessage(f'Zadanie generowania kafli zakończone, wynik zapisany w lokalizacji {self.generator_task.outputPath()}', Qgis.Success, 'loud')
@@ -5,6 +5,8 @@ from qgis.PyQt import QtGui, QtWidgets, uic
 from qgis.PyQt.QtCore import pyqtSignal
 from qgis.PyQt.QtWidgets import QFileDialog
 
+from .generator_task import DEFAULT_RENDER_WORKERS, DEFAULT_ENCODE_WORKERS
+
 sys.path.append(os.path.dirname(__file__))
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
@@ -30,6 +32,20 @@ class TilesGeneratorDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.layers_range_btn.clicked.connect(lambda: self.saveSettings(True))
         self.map_range_btn.clicked.connect(lambda: self.saveSettings(True))
         self.user_range_btn.clicked.connect(self.saveSettings)
+        self.workers_spin.valueChanged.connect(lambda: self.saveSettings())
+        self.encode_workers_spin.valueChanged.connect(lambda: self.saveSettings())
+        self.dedup_check.stateChanged.connect(lambda: self.saveSettings())
+        self.pyramid_combo.currentIndexChanged.connect(lambda: self.saveSettings())
+        self.palette_check.stateChanged.connect(lambda: self.saveSettings())
+        self.format_combo.currentIndexChanged.connect(lambda: self.saveSettings())
+        self.quality_spin.valueChanged.connect(lambda: self.saveSettings())
+        self.png_level_spin.valueChanged.connect(lambda: self.saveSettings())
+        self.resume_check.stateChanged.connect(lambda: self.saveSettings())
+        self.cache_check.stateChanged.connect(lambda: self.saveSettings())
+        self.incremental_check.stateChanged.connect(lambda: self.saveSettings())
+        self.output_combo.currentIndexChanged.connect(lambda: self.saveSettings())
+        self.index_check.stateChanged.connect(lambda: self.saveSettings())
+        self.prune_check.stateChanged.connect(lambda: self.saveSettings())
         self.min_slider.valueChanged.connect(self.updateZoomRange)
         self.max_slider.valueChanged.connect(self.updateZoomRange)
         self.show_path_btn.clicked.connect(self.tilesPath)
@@ -44,6 +60,20 @@ class TilesGeneratorDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         range_option = self.settings.value('tiles_range')
         zoom_min = self.settings.value('tiles_zoom_min')
         zoom_max = self.settings.value('tiles_zoom_max')
+        render_workers = self.settings.value('tiles_render_workers')
+        encode_workers = self.settings.value('tiles_encode_workers')
+        deduplicate = self.settings.value('tiles_deduplicate')
+        pyramid = self.settings.value('tiles_pyramid')
+        palette_png = self.settings.value('tiles_palette_png')
+        tile_format = self.settings.value('tiles_format')
+        tile_quality = self.settings.value('tiles_quality')
+        png_level = self.settings.value('tiles_png_level')
+        resume = self.settings.value('tiles_resume')
+        tile_cache = self.settings.value('tiles_cache')
+        incremental = self.settings.value('tiles_incremental')
+        output_format = self.settings.value('tiles_output')
+        tile_index = self.settings.value('tiles_index')
+        prune_transparent = self.settings.value('tiles_prune_transparent')
         if zip_pack:
             self.zip_check.setChecked(int(zip_pack) == 1)
         if layers_option:
@@ -63,6 +93,38 @@ class TilesGeneratorDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
             self.min_slider.setValue(int(zoom_min))
         if zoom_max:
             self.max_slider.setValue(int(zoom_max))
+        if render_workers:
+            self.workers_spin.setValue(int(render_workers))
+        else:
+            self.workers_spin.setValue(DEFAULT_RENDER_WORKERS)
+        if encode_workers:
+            self.encode_workers_spin.setValue(int(encode_workers))
+        else:
+            self.encode_workers_spin.setValue(DEFAULT_ENCODE_WORKERS)
+        if deduplicate:
+            self.dedup_check.setChecked(int(deduplicate) == 1)
+        if pyramid:
+            self.pyramid_combo.setCurrentIndex(int(pyramid))
+        if palette_png:
+            self.palette_check.setChecked(int(palette_png) == 1)
+        if tile_format:
+            self.format_combo.setCurrentIndex(int(tile_format))
+        if tile_quality:
+            self.quality_spin.setValue(int(tile_quality))
+        if png_level is not None:
+            self.png_level_spin.setValue(int(png_level))
+        if resume:
+            self.resume_check.setChecked(int(resume) == 1)
+        if tile_cache:
+            self.cache_check.setChecked(int(tile_cache) == 1)
+        if incremental:
+            self.incremental_check.setChecked(int(incremental) == 1)
+        if output_format:
+            self.output_combo.setCurrentIndex(int(output_format))
+        if tile_index:
+            self.index_check.setChecked(int(tile_index) == 1)
+        if prune_transparent:
+            self.prune_check.setChecked(int(prune_transparent) == 1)
         self.updateDisplayLabels()
 
     def saveSettings(self, clear_extent_tool=False):
@@ -85,6 +147,20 @@ class TilesGeneratorDockWidget(QtWidgets.QDockWidget, FORM_CLASS):
         self.settings.setValue('tiles_range', range_option)
         self.settings.setValue('tiles_zoom_min', self.min_slider.value())
         self.settings.setValue('tiles_zoom_max', self.max_slider.value())
+        self.settings.setValue('tiles_render_workers', self.workers_spin.value())
+        self.settings.setValue('tiles_encode_workers', self.encode_workers_spin.value())
+        self.settings.setValue('tiles_deduplicate', 1 if self.dedup_check.isChecked() else 0)
+        self.settings.setValue('tiles_pyramid', self.pyramid_combo.currentIndex())
+        self.settings.setValue('tiles_palette_png', 1 if self.palette_check.isChecked() else 0)
+        self.settings.setValue('tiles_format', self.format_combo.currentIndex())
+        self.settings.setValue('tiles_quality', self.quality_spin.value())
+        self.settings.setValue('tiles_png_level', self.png_level_spin.value())
+        self.settings.setValue('tiles_resume', 1 if self.resume_check.isChecked() else 0)
+        self.settings.setValue('tiles_cache', 1 if self.cache_check.isChecked() else 0)
+        self.settings.setValue('tiles_incremental', 1 if self.incremental_check.isChecked() else 0)
+        self.settings.setValue('tiles_output', self.output_combo.currentIndex())
+        self.settings.setValue('tiles_index', 1 if self.index_check.isChecked() else 0)
+        self.settings.setValue('tiles_prune_transparent', 1 if self.prune_check.isChecked() else 0)
 
     def updateZoomRange(self, value):
         sender = self.sender()